@@ -1,23 +1,105 @@
+import time
+started_at = time.perf_counter()
+
 import discord
 import asyncio
+import logging
 import os
+import re
+import traceback
+from datetime import datetime
 from discord.ext import commands
 from mcstatus import MinecraftServer
 
 from utils.ChannelWatchManager import ChannelManager
+from utils.SendScheduler import SendScheduler, PRIORITY_COMMAND, PRIORITY_STATUS
+from utils.Metrics import metrics
+from utils.HttpEndpoint import HttpEndpoint
+from utils.MessagePurge import MessagePurge, snowflake_ago
 
 token = None
 if 'CREPESBOT_TOKEN' in os.environ:
     token = os.environ['CREPESBOT_TOKEN']
 
-bot = commands.Bot(command_prefix=commands.when_mentioned_or('!'))
-bot.remove_command('help')
+# Sharded mode trades the default caches for flat memory use as the guild count grows
+sharded = os.environ.get('CREPESBOT_SHARDED', '0') == '1'
+
+def client_options():
+    options = {'command_prefix': commands.when_mentioned_or('!')}
+    if sharded:
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+    else:
+        intents = discord.Intents.default()
+    if hasattr(intents, 'message_content'):
+        # Privileged on discord.py 2.x, prefix commands can't be read without it
+        intents.message_content = True
+    options['intents'] = intents
+    if sharded:
+        options.update(member_cache_flags=discord.MemberCacheFlags.none(), max_messages=None, chunk_guilds_at_startup=False)
+        if 'CREPESBOT_SHARD_COUNT' in os.environ:
+            options['shard_count'] = int(os.environ['CREPESBOT_SHARD_COUNT'])
+    return options
+
+class CrepesBot(commands.AutoShardedBot if sharded else commands.Bot):
+    async def close(self):
+        # Flush pending watchlist changes on every shutdown path, not just !shutdown
+        await channelManager.close()
+        sendScheduler.cancel()
+        await httpEndpoint.stop()
+        await super().close()
+
+# Set up in main(), probe worker processes re-import this module and must not build any of it
+bot = None
+channelManager = None
+sendScheduler = None
+httpEndpoint = None
+restored = False
+
+class RateLimitCounter(logging.Handler):
+    def emit(self, record):
+        # discord.py retries 429s internally and only reports them through its logger
+        if 'rate limited' in record.getMessage():
+            metrics.incr('discord_rate_limited_total')
+
+def count_requests(request):
+    async def counted_request(route, **kwargs):
+        metrics.incr('discord_requests_total', label=route.method + ' ' + route.path)
+        return await request(route, **kwargs)
+    return counted_request
+
+pending_changes = {}
+pending_reposts = set()
+first_post_at = None
+
+MAX_IMPORT_BYTES = 256 * 1024
 
-channelManager = ChannelManager()
+def parse_servers(text):
+    servers = []
+    for line in text.splitlines():
+        line = line.split('#')[0]
+        servers.extend(s for s in re.split(r'[\s,]+', line) if len(s) > 0)
+    return servers
+
+def batch_embed(title, servers, requested):
+    if len(servers) == 1 and requested == 1:
+        return discord.Embed(title=f'{title}: {servers[0]}')
+    em = discord.Embed(title=f'{title}: {len(servers)} of {requested} servers')
+    listing = '\n'.join(servers)
+    if len(listing) > 2000:
+        listing = listing[:2000].rsplit('\n', 1)[0] + '\n...'
+    if len(listing) > 0:
+        em.description = listing
+    return em
+
+async def reply(ctx, embed):
+    return await sendScheduler.submit(ctx.channel, lambda: ctx.send(embed=embed), priority=PRIORITY_COMMAND)
 
 async def clear_bot_messages(channel):
-    msgs = await channel.history(limit=10).flatten()
-            
+    # history() has no flatten() on discord.py 2.x, iterating works on both
+    msgs = [msg async for msg in channel.history(limit=10)]
+
     crepesbot_msgs = []
     for msg in msgs:
         if msg.author == bot.user:
@@ -27,118 +109,236 @@ async def clear_bot_messages(channel):
     if len(crepesbot_msgs) > 0:
         await channel.delete_messages(crepesbot_msgs)
 
+async def post_status(channel):
+    changed = pending_changes.pop(channel.id, set())
+    repost = channel.id in pending_reposts
+    pending_reposts.discard(channel.id)
+    if len(changed) == 0 and not repost:
+        return
+
+    try:
+        tracker = channelManager.get_status_tracker(channel)
+        if repost:
+            await tracker.clear(channel)
+        if repost or tracker.is_empty():
+            await clear_bot_messages(channel)
+        await tracker.publish(channel, channelManager.get_servers(channel), changed)
+    except Exception:
+        # Put the changes back, a 429 retry or the next poll cycle publishes the same set again
+        pending_changes.setdefault(channel.id, set()).update(changed)
+        if repost:
+            pending_reposts.add(channel.id)
+        raise
+
+    global first_post_at
+    if first_post_at is None:
+        first_post_at = time.perf_counter() - started_at
+        metrics.set('startup_first_post_seconds', first_post_at)
+        print(f'First status posted {first_post_at:.2f}s after start')
+
+def queue_status(channel, changed, repost=False, priority=PRIORITY_STATUS):
+    # Queued updates for a channel are merged, the job publishes whatever is pending when it runs
+    pending_changes.setdefault(channel.id, set()).update(changed)
+    if repost:
+        pending_reposts.add(channel.id)
+    return sendScheduler.submit(channel, lambda: post_status(channel), priority=priority, route='status', key='status')
+
+def is_shard_connected(shard_id):
+    shards = getattr(bot, 'shards', None)
+    if shards is None:
+        return bot.is_ready()
+    shard = shards.get(shard_id)
+    return shard is not None and not shard.is_closed()
+
 async def my_background_task():
-    await bot.wait_until_ready()
+    # Probing starts while the gateway is still connecting, results are posted once it's ready
+    await httpEndpoint.start()
+    asyncio.ensure_future(channelManager.refresh_remote(bot, not restored))
     while not bot.is_closed(): 
         try:
-            for channel in channelManager.channels: 
-                status_embeds = channelManager.get_updated_status_embeds(channel)
-                if(len(status_embeds) > 0):
-                    await clear_bot_messages(channel)
-                    for em in status_embeds:
-                        await channel.send(embed=em)
-                #else:
-                    #await channel.send(embed=discord.Embed(title='No status updates', color=0x0000ff))
+            await channelManager.update_due_statuses()
+            for shard_id, channels in channelManager.get_shards().items():
+                # Changes for a shard that isn't connected are held until it is, then posted together
+                if not is_shard_connected(shard_id):
+                    continue
+                for channel in channels: 
+                    changed = channelManager.get_changed_servers(channel)
+                    if(len(changed) > 0 or len(pending_changes.get(channel.id, ())) > 0 or channel.id in pending_reposts):
+                        queue_status(channel, changed)
+                    #else:
+                        #await channel.send(embed=discord.Embed(title='No status updates', color=0x0000ff))
         except Exception as e:
-            print(e)
+            metrics.incr('poll_errors_total')
+            print('Error in poll cycle: ' + str(e))
+            traceback.print_exc()
 
-        await asyncio.sleep(60)
+        # Sleeps until the next server is due, instead of a flat 60s after each pass
+        await channelManager.wait_until_due()
 
-@bot.event
 async def on_ready():
     print('Bot is ready')
-    await channelManager.load(bot)
+    if metrics.get_gauge('startup_ready_seconds') is None:
+        metrics.set('startup_ready_seconds', time.perf_counter() - started_at)
+    channelManager.bind(bot)
+    channelManager.wake()
+
+async def on_guild_available(guild):
+    # Guilds that were unavailable at ready come back later, their restored channels are bound then
+    if len(channelManager.unbound) > 0:
+        channelManager.bind(bot, report=False)
+        channelManager.wake()
+
+async def on_shard_ready(shard_id):
+    # Each shard starts posting for its own channels as soon as it's up, without waiting for the rest
+    print('Shard ' + str(shard_id) + ' is ready')
+    channelManager.bind(bot, report=False)
+    channelManager.wake()
 
-@bot.command()
+@commands.command()
 @commands.has_permissions(administrator=True)
 async def shutdown(ctx):
-    await ctx.send(embed=discord.Embed(title='Shutting down CrepesBot...', color=0xff00ff))
-    await ctx.bot.logout()
+    await reply(ctx, discord.Embed(title='Shutting down CrepesBot...', color=0xff00ff))
+    await ctx.bot.close()
 
-@bot.command()
+@commands.command()
 @commands.has_permissions(manage_messages=True)
-async def clear(ctx, *, number):
+async def clear(ctx, number, *filters):
     try:
-        msgs = [] #Empty list to put all the messages in the log
-        number = int(number) + 1 #Converting the amount of messages to delete to an integer
-        msgs = await ctx.channel.history(limit=number).flatten()
-        await ctx.channel.delete_messages(msgs)
+        number = int(number)
+        if number <= 0:
+            await reply(ctx, discord.Embed(title='Number of messages to clear must be at least 1'))
+            return
+        # Only mentions after the command count, the @CrepesBot prefix is a mention too
+        authors = set()
+        bots_only = False
+        # The command itself is the newest message, everything is purged from before it
+        before = ctx.message.id
+        after = None
+        for f in filters:
+            mention = re.fullmatch(r'<@!?(\d+)>', f)
+            if mention is not None:
+                authors.add(int(mention.group(1)))
+            elif f == 'bots':
+                bots_only = True
+            elif f.startswith('after:'):
+                after = snowflake_ago(parse_duration(f[len('after:'):]))
+            elif f.startswith('before:'):
+                before = min(before, snowflake_ago(parse_duration(f[len('before:'):])))
+
+        def check(msg):
+            if len(authors) > 0 and msg.author.id not in authors:
+                return False
+            return not bots_only or msg.author.bot
+
+        message = await reply(ctx, discord.Embed(title='Clearing messages...'))
+        purge = MessagePurge(ctx.channel, sendScheduler, number, check=check, before=before, after=after,
+            scan_limit=int(os.environ.get('CREPESBOT_PURGE_SCAN_LIMIT', 10000)), progress=progress_reporter(ctx, message))
+        await purge.run()
+        await sendScheduler.submit(ctx.channel, lambda: ctx.message.delete(), priority=PRIORITY_COMMAND, route='delete_single')
     except Exception as e:
         print(e)
+        await reply(ctx, discord.Embed(title='Error clearing messages...'))
 
-@bot.command()
+def parse_duration(value):
+    match = re.fullmatch(r'(\d+)([smhd]?)', value)
+    if match is None:
+        raise ValueError('Invalid duration: ' + value)
+    return int(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+@commands.command()
 @commands.has_permissions(administrator=True)
-async def add(ctx, *, server):
+async def add(ctx, *, server=''):
     try:
-        channelManager.add_server(ctx.channel, server)
-        await ctx.send(embed=discord.Embed(title=f'Now Watching: {server}'))
+        servers = parse_servers(server)
+        for attachment in ctx.message.attachments:
+            # An attached watchlist file is imported as one batch
+            if attachment.size > MAX_IMPORT_BYTES:
+                await reply(ctx, discord.Embed(title=f'Watchlist file too large: {attachment.filename}'))
+                return
+            servers.extend(parse_servers((await attachment.read()).decode('utf-8', 'replace')))
+        if len(servers) == 0:
+            await reply(ctx, discord.Embed(title='No servers given', description='Usage: !add <server> [server...], or attach a file with one server per line'))
+            return
+        added = channelManager.add_servers(ctx.channel, servers)
+        await reply(ctx, batch_embed('Now Watching', added, len(servers)))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title=f'Error trying to watch: {server}'))
+        await reply(ctx, discord.Embed(title=f'Error trying to watch: {server}'))
 
-@bot.command()
+@commands.command()
 async def set_aternos_server(ctx, *, server):
     try:
         channelManager.set_aternos_server(ctx.channel, server)
-        await ctx.send(embed=discord.Embed(title=f'Target Aternos Server Set: {server}'))
+        await reply(ctx, discord.Embed(title=f'Target Aternos Server Set: {server}'))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title=f'Error trying to set Aternos server: {server}'))
+        await reply(ctx, discord.Embed(title=f'Error trying to set Aternos server: {server}'))
 
-@bot.command()
+@commands.command()
 async def get_aternos_server(ctx):
     try:
         server = channelManager.get_aternos_server(ctx.channel)
-        await ctx.send(embed=discord.Embed(title=f'Aternos Server: {server}'))
+        await reply(ctx, discord.Embed(title=f'Aternos Server: {server}'))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title=f'Error trying to get Aternos server: {server}'))
+        await reply(ctx, discord.Embed(title=f'Error trying to get Aternos server: {server}'))
+
+def progress_reporter(ctx, message):
+    def report(text, done):
+        color = 0x00ff00 if done else 0xffff00
+        # Only the newest progress edit for a message is kept in the send queue
+        sendScheduler.submit(ctx.channel, lambda: message.edit(embed=discord.Embed(title=text, color=color)), priority=PRIORITY_COMMAND, route='edit', key=('progress', message.id))
+    return report
 
-@bot.command()
+@commands.command()
 async def start(ctx):
     try:
-        await ctx.send(embed=discord.Embed(title=f'Starting server...'))
-        channelManager.start_aternos_server(ctx.channel)
-        await ctx.send(embed=discord.Embed(title=f'Server started.'))
+        message = await reply(ctx, discord.Embed(title=f'Starting server...'))
+        channelManager.start_aternos_server(ctx.channel, progress_reporter(ctx, message))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title=f'Error trying to start server.'))
+        await reply(ctx, discord.Embed(title=f'Error trying to start server.'))
 
-@bot.command()
+@commands.command()
 async def stop(ctx):
     try:
-        await ctx.send(embed=discord.Embed(title=f'Stopping server...'))
-        channelManager.stop_aternos_server(ctx.channel)
-        await ctx.send(embed=discord.Embed(title=f'Server stopped.'))
+        message = await reply(ctx, discord.Embed(title=f'Stopping server...'))
+        channelManager.stop_aternos_server(ctx.channel, progress_reporter(ctx, message))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title=f'Error trying to stop server.'))
+        await reply(ctx, discord.Embed(title=f'Error trying to stop server.'))
 
 
 
-@bot.command()
+@commands.command()
 @commands.has_permissions(administrator=True)
 async def remove(ctx, *, server):
     try:
-        channelManager.remove_server(ctx.channel, server)
-        await ctx.send(embed=discord.Embed(title=f'Stopped Watching: {server}'))
+        servers = parse_servers(server)
+        removed = channelManager.remove_servers(ctx.channel, servers)
+        await reply(ctx, batch_embed('Stopped Watching', removed, len(servers)))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title=f'Error trying to stop watching: {server}'))
+        await reply(ctx, discord.Embed(title=f'Error trying to stop watching: {server}'))
 
-@bot.command()
+@commands.command()
 @commands.has_permissions(administrator=True)
 async def help(ctx):
     em = discord.Embed(title='Help Commands')
 
-    em.add_field(name="!add <server>", value='Add <server> to the watchlist', inline=False)
-    em.add_field(name="!remove <server>", value='Remove <server> from the watchlist', inline=False)
+    em.add_field(name="!add <server> [server...]", value='Add servers to the watchlist, or attach a file with one server per line', inline=False)
+    em.add_field(name="!remove <server> [server...]", value='Remove servers from the watchlist', inline=False)
     em.add_field(name="!watchlist", value='View list of servers being watched', inline=False)
     em.add_field(name="!status", value='Get status of all servers on the watchlist', inline=False)
+    em.add_field(name="!history <server> [hours]", value='Hourly uptime and peak players for <server>', inline=False)
+    em.add_field(name="!uptime [server] [days]", value='Uptime over the last [days] (default 7)', inline=False)
+    em.add_field(name="!peak [server] [days]", value='Peak player count over the last [days] (default 7)', inline=False)
+    em.add_field(name="!clear <number> [@user...] [bots] [after:<age>] [before:<age>]", value='Delete up to <number> messages, e.g. after:2h or before:30d', inline=False)
+    em.add_field(name="!stats", value='Bot performance statistics', inline=False)
 
-    await ctx.send(embed=em)
+    await reply(ctx, em)
 
-@bot.command()
+@commands.command()
 @commands.has_permissions(administrator=True)
 async def watchlist(ctx):
     try:
@@ -152,27 +352,169 @@ async def watchlist(ctx):
             servers = "\n".join(watchlist)
         em.add_field(name="Servers", value=servers, inline=True)
 
-        await ctx.send(embed=em)
+        await reply(ctx, em)
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title='Error getting watchlist...'))
+        await reply(ctx, discord.Embed(title='Error getting watchlist...'))
 
-@bot.command()
+@commands.command()
 @commands.has_permissions(administrator=True)
 async def status(ctx):
     try:
-        await ctx.send(embed=discord.Embed(title='Checking status...'))
-        status_embeds = channelManager.get_status_embeds(ctx.channel)
-        if(len(status_embeds) > 0):
-            await clear_bot_messages(ctx.channel)
-            for em in status_embeds:
-                await ctx.send(embed=em)
+        # Cached results go out right away, anything older than CREPESBOT_STATUS_TTL is refreshed behind them
+        servers = channelManager.get_cached_servers(ctx.channel)
+        if(len(servers) > 0):
+            await queue_status(ctx.channel, servers, repost=True, priority=PRIORITY_COMMAND)
         else:
-            await ctx.send(embed=discord.Embed(title='No status updates'))
+            await reply(ctx, discord.Embed(title='No status updates'))
     except Exception as e:
         print(e)
-        await ctx.send(embed=discord.Embed(title='Error checking status...'))
+        await reply(ctx, discord.Embed(title='Error checking status...'))
 
+def format_time(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M UTC')
+
+@commands.command()
+async def history(ctx, server, hours='24'):
+    try:
+        hours = max(1, min(int(hours), 48))
+        histories = channelManager.get_histories(ctx.channel, server)
+        if len(histories) == 0:
+            await reply(ctx, discord.Embed(title=f'Not watching: {server}'))
+            return
+
+        name, server_history = histories[0]
+        lines = []
+        for start, total, online, peak in server_history.hourly(hours):
+            uptime = f'{online / total:.0%}' if total > 0 else '-'
+            lines.append(f'`{format_time(start)[5:16]}` {uptime} up, peak {peak}')
+        em = discord.Embed(title=f'History: {name}', description="\n".join(lines) if len(lines) > 0 else 'No data yet')
+        await reply(ctx, em)
+    except Exception as e:
+        print(e)
+        await reply(ctx, discord.Embed(title=f'Error getting history: {server}'))
+
+@commands.command()
+async def uptime(ctx, server=None, days='7'):
+    try:
+        days = float(days)
+        em = discord.Embed(title=f'Uptime (last {days:g} days)')
+        for name, server_history in channelManager.get_histories(ctx.channel, server)[:25]:
+            ratio = server_history.uptime(days * 86400)
+            em.add_field(name=name, value='No data yet' if ratio is None else f'{ratio:.1%}', inline=False)
+        await reply(ctx, em)
+    except Exception as e:
+        print(e)
+        await reply(ctx, discord.Embed(title='Error getting uptime...'))
+
+@commands.command()
+async def peak(ctx, server=None, days='7'):
+    try:
+        days = float(days)
+        em = discord.Embed(title=f'Peak Players (last {days:g} days)')
+        for name, server_history in channelManager.get_histories(ctx.channel, server)[:25]:
+            best = server_history.peak(days * 86400)
+            em.add_field(name=name, value='No data yet' if best is None else f'{best[0]} at {format_time(best[1])}', inline=False)
+        await reply(ctx, em)
+    except Exception as e:
+        print(e)
+        await reply(ctx, discord.Embed(title='Error getting peak players...'))
+
+def format_seconds(value):
+    if value is None:
+        return '-'
+    if value == float('inf'):
+        return '>10s'
+    return f'{value * 1000:.0f}ms'
+
+@commands.command()
+@commands.has_permissions(administrator=True)
+async def stats(ctx):
+    try:
+        if not metrics.enabled:
+            await reply(ctx, discord.Embed(title='Metrics are disabled (CREPESBOT_METRICS=0)'))
+            return
+        em = discord.Embed(title='CrepesBot Stats')
+
+        cycle = metrics.get_histogram('poll_cycle_seconds')
+        lag = metrics.get_histogram('poll_lag_seconds')
+        em.add_field(name="Poll", value=f"cycles: {metrics.get_counter('poll_cycles_total')}\nerrors: {metrics.get_counter('poll_errors_total')}\n"
+            f"cycle avg: {format_seconds(cycle.mean() if cycle else None)}\nlag p95: {format_seconds(lag.quantile(0.95) if lag else None)}", inline=True)
+
+        probe = metrics.get_histogram('probe_seconds')
+        tcp = metrics.get_histogram('probe_tier_seconds', 'tcp')
+        full = metrics.get_histogram('probe_tier_seconds', 'full')
+        em.add_field(name="Probe tiers", value=f"tcp: {metrics.get_counter('probe_tier_total', 'tcp')} (avg {format_seconds(tcp.mean() if tcp else None)})\n"
+            f"full: {metrics.get_counter('probe_tier_total', 'full')} (avg {format_seconds(full.mean() if full else None)})", inline=True)
+
+        em.add_field(name="Probes", value=f"total: {metrics.get_counter('probes_total')}\noffline: {metrics.get_counter('probes_offline_total')}\n"
+            f"p50: {format_seconds(probe.quantile(0.5) if probe else None)}\np95: {format_seconds(probe.quantile(0.95) if probe else None)}", inline=True)
+
+        def ratio(hits, misses):
+            return f'{hits / (hits + misses):.0%}' if hits + misses > 0 else '-'
+        dns_hits, dns_misses = metrics.get_counter('dns_cache_hits_total'), metrics.get_counter('dns_cache_misses_total')
+        cache_hits, cache_misses = metrics.get_counter('status_cache_hits_total'), metrics.get_counter('status_cache_misses_total')
+        em.add_field(name="Caches", value=f"DNS hit rate: {ratio(dns_hits, dns_misses)}\nstatus hit rate: {ratio(cache_hits, cache_misses)}", inline=True)
+
+        send_stats = sendScheduler.get_stats()
+        em.add_field(name="Discord", value=f"requests: {metrics.get_counter_total('discord_requests_total')}\n429s: {metrics.get_counter('discord_rate_limited_total')}\n"
+            f"queue: {send_stats['depth']}\nwait avg: {format_seconds(send_stats['avg_wait'])}", inline=True)
+
+        save = metrics.get_histogram('save_seconds')
+        em.add_field(name="Saves", value=f"uploads: {save.count if save else 0}\nskipped: {metrics.get_counter('saves_skipped_total')}\n"
+            f"avg: {format_seconds(save.mean() if save else None)}", inline=True)
+
+        em.add_field(name="Startup", value=f"restore: {format_seconds(metrics.get_gauge('startup_restore_seconds'))}\nready: {format_seconds(metrics.get_gauge('startup_ready_seconds'))}\n"
+            f"first post: {format_seconds(metrics.get_gauge('startup_first_post_seconds'))}", inline=True)
+
+        slowest = metrics.get_slowest('probe_seconds')
+        if len(slowest) > 0:
+            em.add_field(name="Slowest servers (p95)", value="\n".join(f'{server}: {format_seconds(p95)}' for p95, server in slowest), inline=False)
+
+        await reply(ctx, em)
+    except Exception as e:
+        print(e)
+        await reply(ctx, discord.Embed(title='Error getting stats...'))
+
+
+async def run():
+    global bot, channelManager, sendScheduler, httpEndpoint, restored
+    bot = CrepesBot(**client_options())
+    bot.remove_command('help')
+    for value in list(globals().values()):
+        if isinstance(value, commands.Command):
+            bot.add_command(value)
+    bot.event(on_ready)
+    bot.event(on_shard_ready)
+    bot.event(on_guild_available)
+
+    channelManager = ChannelManager()
+    # The watchlist comes from local storage before login, Dropbox is only consulted once we're running
+    restored = channelManager.restore()
+    sendScheduler = SendScheduler()
+    httpEndpoint = HttpEndpoint()
+    httpEndpoint.add_route('/metrics', lambda: ('text/plain; version=0.0.4', metrics.render_prometheus()))
+    httpEndpoint.add_route('/status.json', lambda: ('application/json', channelManager.get_status_json()))
+    metrics.add_collector(lambda: {'send_queue_depth': sendScheduler.get_depth(), 'watched_servers': len(channelManager.registry.servers), 'watched_channels': len(channelManager.channels)})
+
+    if metrics.enabled:
+        logging.getLogger('discord.http').addHandler(RateLimitCounter())
+        bot.http.request = count_requests(bot.http.request)
+
+    # bot.loop is only usable once the client is running on discord.py 2.x, so the loop is ours
+    asyncio.ensure_future(my_background_task())
+    try:
+        await bot.start(token)
+    finally:
+        if not bot.is_closed():
+            await bot.close()
+
+def main():
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
 
-bot.loop.create_task(my_background_task())
-bot.run(token)
+# Probe worker processes are spawned and re-import this module as __mp_main__, they must not start the bot
+if __name__ == '__main__':
+    main()
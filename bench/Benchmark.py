@@ -0,0 +1,104 @@
+# Usage: python -m bench.Benchmark --servers 10,100,1000 --channels 1,10,100 | tee bench_output.txt
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+import tracemalloc
+
+from bench.FakeDiscord import RecordingChannel, FakeDropBoxManager
+from bench.FakeMinecraftServer import FakeMinecraftServer, loopback_addresses
+from utils.ChannelWatchManager import ChannelManager
+from utils.Storage import MemoryStorage
+
+def quiet():
+    # Keeps the bot's diagnostic prints out of the timings
+    return contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+def parse_sizes(value):
+    return [int(v) for v in value.split(',') if len(v) > 0]
+
+async def run_cycle(manager, channels):
+    for channel in channels:
+        channel.reset_calls()
+    start = time.perf_counter()
+    await manager.registry.refresh(force=True)
+    probe_time = time.perf_counter() - start
+    for channel in channels:
+        changed = manager.get_changed_servers(channel)
+        if len(changed) > 0:
+            await manager.get_status_tracker(channel).publish(channel, manager.get_servers(channel), changed)
+    cycle_time = time.perf_counter() - start
+    return cycle_time, probe_time, sum(c.get_call_count() for c in channels)
+
+async def run_case(fake, servers, channel_count, cycles, timeout):
+    manager = ChannelManager(storage=MemoryStorage())
+    manager.poller.timeout = timeout
+    manager.dbx_manager = FakeDropBoxManager()
+    manager.saver.dbx_manager = manager.dbx_manager
+    channels = [RecordingChannel(i + 1) for i in range(channel_count)]
+
+    with quiet():
+        for i, address in enumerate(loopback_addresses(servers, fake.port)):
+            manager.add_server(channels[i % channel_count], address)
+
+        start = time.perf_counter()
+        await manager.saver.flush()
+        save_time = time.perf_counter() - start
+
+        samples = [await run_cycle(manager, channels) for _ in range(cycles)]
+
+        # Measured on a separate cycle, tracemalloc slows allocation heavy code down a lot
+        tracemalloc.start()
+        await run_cycle(manager, channels)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    await manager.saver.close()
+    manager.poller.cancel()
+
+    cycle_time = sum(s[0] for s in samples) / len(samples)
+    probe_time = sum(s[1] for s in samples) / len(samples)
+    return {
+        'servers': servers,
+        'channels': channel_count,
+        'cycle_s': cycle_time,
+        'probes_per_s': servers / probe_time if probe_time > 0 else 0.0,
+        'discord_calls': sum(s[2] for s in samples) / len(samples),
+        'peak_mb': peak_memory / (1024 * 1024),
+        'save_ms': save_time * 1000,
+        'upload_kb': manager.dbx_manager.uploaded_bytes / 1024,
+    }
+
+async def main(args):
+    fake = FakeMinecraftServer(latency=args.latency, failure_rate=args.failure_rate, hang_rate=args.hang_rate, churn=args.churn, query=args.query)
+    await fake.start()
+    print(f'Fake Minecraft server on port {fake.port} (latency {args.latency}s, failure rate {args.failure_rate}, hang rate {args.hang_rate}, churn {args.churn})')
+    print(f"{'servers':>8} {'channels':>8} {'cycle_s':>9} {'probes/s':>10} {'calls/cycle':>12} {'peak_mb':>9} {'save_ms':>9} {'upload_kb':>10}")
+    try:
+        for servers in parse_sizes(args.servers):
+            for channel_count in parse_sizes(args.channels):
+                if channel_count > servers:
+                    continue
+                result = await run_case(fake, servers, channel_count, args.cycles, args.timeout)
+                print(f"{result['servers']:>8} {result['channels']:>8} {result['cycle_s']:>9.3f} {result['probes_per_s']:>10.1f} {result['discord_calls']:>12.1f} {result['peak_mb']:>9.2f} {result['save_ms']:>9.2f} {result['upload_kb']:>10.1f}")
+    finally:
+        await fake.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark CrepesBot polling, posting and saving against local fakes')
+    parser.add_argument('--servers', default='10,100,1000,10000')
+    parser.add_argument('--channels', default='1,10,100,1000')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--churn', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--query', action='store_true')
+    args = parser.parse_args()
+    os.environ['CREPESBOT_PROBE_WORKERS'] = str(args.workers)
+    os.environ['CREPESBOT_QUERY'] = '1' if args.query else '0'
+    os.environ.pop('DROPBOX_TOKEN', None)
+    asyncio.run(main(args))
@@ -0,0 +1,74 @@
+import itertools
+
+message_ids = itertools.count(1)
+
+class FakeMessage:
+    def __init__(self, channel, message_id, author=None):
+        self.channel = channel
+        self.id = message_id
+        self.author = author
+
+    async def edit(self, **kwargs):
+        self.channel.record('edit')
+
+    async def delete(self):
+        self.channel.record('delete')
+        self.channel.messages.pop(self.id, None)
+
+class FakeHistory:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def flatten(self):
+        return self.messages
+
+class RecordingChannel:
+    def __init__(self, channel_id, user=None):
+        self.id = channel_id
+        self.user = user
+        self.messages = {}
+        self.calls = {}
+
+    def record(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get_call_count(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls = {}
+
+    async def send(self, content=None, embed=None, embeds=None):
+        self.record('send')
+        message = FakeMessage(self, next(message_ids), self.user)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id, self.user)
+
+    def history(self, limit=100):
+        self.record('history')
+        return FakeHistory(list(reversed(list(self.messages.values())))[:limit])
+
+    async def delete_messages(self, messages):
+        self.record('delete_messages')
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+class FakeDropBoxManager:
+    def __init__(self):
+        self.connected = True
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def upload(self, filename, json_content):
+        self.uploads += 1
+        self.uploaded_bytes += len(json_content)
+        return True
+
+    def download(self, filename):
+        return '{}'
+
+    def read_local(self, filename):
+        return '{}'
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import random
+import struct
+import zlib
+
+def write_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+async def read_varint(reader):
+    result = 0
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        result |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return result
+    raise ValueError('VarInt too big')
+
+def make_packet(packet_id, payload):
+    data = write_varint(packet_id) + payload
+    return write_varint(len(data)) + data
+
+class FakeMinecraftServer:
+    def __init__(self, latency=0.0, failure_rate=0.0, hang_rate=0.0, max_players=20, churn=0.0, seed=0, query=False):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.max_players = max_players
+        self.churn = churn
+        self.random = random.Random(seed)
+        self.server = None
+        self.port = None
+        self.connections = 0
+        self.status_requests = 0
+        self.query_requests = 0
+        self.players = {}
+        self.query = query
+        self.query_transport = None
+        self.token = self.random.randint(1, 2 ** 31 - 1)
+
+    async def start(self, host='0.0.0.0', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.query:
+            # The query protocol listens on UDP, on the same port number as the game
+            self.query_transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(lambda: FakeQueryProtocol(self), local_addr=(host, self.port))
+        return self.port
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        if self.query_transport is not None:
+            self.query_transport.close()
+
+    def handle_query(self, data, addr):
+        if len(data) < 7 or data[:2] != b'\xfe\xfd':
+            return
+        self.query_requests += 1
+        kind, session = data[2], data[3:7]
+        if kind == 9:
+            self.query_transport.sendto(b'\x09' + session + str(self.token).encode('ascii') + b'\x00', addr)
+        elif kind == 0 and len(data) >= 11 and struct.unpack('>i', data[7:11])[0] == self.token:
+            names = [f'player{i}' for i in range(self.get_players(addr[0]))]
+            info = {'hostname': 'Fake server', 'gametype': 'SMP', 'version': '1.16.4', 'plugins': 'FakeBukkit 1.0', 'numplayers': str(len(names)), 'maxplayers': str(self.max_players)}
+            payload = b'splitnum\x00\x80\x00' + b''.join(k.encode() + b'\x00' + v.encode() + b'\x00' for k, v in info.items()) + b'\x00'
+            payload += b'\x01player_\x00\x00' + b''.join(n.encode() + b'\x00' for n in names) + b'\x00'
+            self.query_transport.sendto(b'\x00' + session + payload, addr)
+
+    def get_players(self, address):
+        # Each loopback address behaves like its own server, with a stable base player count
+        if address not in self.players or self.random.random() < self.churn:
+            self.players[address] = self.random.randint(0, self.max_players)
+        return self.players[address]
+
+    def is_failing(self, address, rate):
+        return rate > 0 and (zlib.crc32(address.encode('utf-8')) % 10000) < rate * 10000
+
+    def get_status(self, address):
+        return {
+            'version': {'name': '1.16.4', 'protocol': 754},
+            'players': {'online': self.get_players(address), 'max': self.max_players, 'sample': []},
+            'description': {'text': 'Fake server ' + address},
+        }
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        address = writer.get_extra_info('sockname')[0]
+        try:
+            if self.is_failing(address, self.failure_rate):
+                return
+            if self.is_failing(address, self.failure_rate + self.hang_rate):
+                await asyncio.sleep(3600)
+                return
+            while True:
+                length = await read_varint(reader)
+                data = await reader.readexactly(length)
+                packet_id = data[0]
+                if packet_id == 0 and length == 1:
+                    self.status_requests += 1
+                    if self.latency > 0:
+                        await asyncio.sleep(self.latency)
+                    payload = json.dumps(self.get_status(address)).encode('utf-8')
+                    writer.write(make_packet(0, write_varint(len(payload)) + payload))
+                elif packet_id == 1:
+                    writer.write(make_packet(1, data[1:]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+class FakeQueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.handle_query(data, addr)
+
+def loopback_addresses(count, port):
+    # Every 127.0.0.0/8 address reaches the fake server, giving distinct server keys without DNS
+    return [f'127.{1 + (i + 1) // 65536}.{((i + 1) // 256) % 256}.{(i + 1) % 256}:{port}' for i in range(count)]
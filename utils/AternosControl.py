@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import re
+import aiohttp
+
+from utils.Metrics import metrics
+from utils.Probe import probe_server
+
+ATERNOS_AJAX_URL = 'https://aternos.org/panel/ajax/'
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:72.0) Gecko/20100101 Firefox/72.0"
+# Aternos keeps answering pings while a server is down, the state is in the version name
+PENDING_STATES = ('offline', 'starting', 'loading', 'preparing', 'queue', 'waiting', 'saving', 'stopping')
+
+def describe(raw):
+    if raw is None:
+        return 'Unreachable'
+    version = str(raw.get('version', {}).get('name', ''))
+    return re.sub('§.', '', version).strip(' ●⚠') or 'Online'
+
+def is_running(raw):
+    if raw is None:
+        return False
+    version = str(raw.get('version', {}).get('name', '')).lower()
+    return not any(state in version for state in PENDING_STATES)
+
+class AternosSession:
+    def __init__(self, api_info):
+        self.api_info = api_info
+        self.proxy = os.environ.get('FIXIE_URL') or None
+        self.session = None
+
+    def get_session(self):
+        # One keep-alive session per account, reused across every start and stop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers={'User-Agent': USER_AGENT, 'Cookie': self.api_info['header_cookie']},
+                cookies={'ATERNOS_SESSION': self.api_info['cookie']},
+                connector=aiohttp.TCPConnector(limit=2, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30))
+        return self.session
+
+    async def request(self, action, params=None):
+        query = dict(params or {})
+        query['SEC'] = self.api_info['asec']
+        async with self.get_session().get(ATERNOS_AJAX_URL + action + '.php', params=query, proxy=self.proxy) as response:
+            return response.status, await response.text()
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+class AternosOperation:
+    def __init__(self, action):
+        self.action = action
+        self.callbacks = []
+        self.task = None
+        self.state = None
+
+class AternosControl:
+    def __init__(self, poller, interval=None, limit=None):
+        if interval is None:
+            interval = float(os.environ.get('CREPESBOT_ATERNOS_POLL_INTERVAL', 10))
+        if limit is None:
+            limit = float(os.environ.get('CREPESBOT_ATERNOS_TIMEOUT', 600))
+        self.poller = poller
+        self.interval = interval
+        self.limit = limit
+        self.sessions = {}
+        self.operations = {}
+
+    def get_session(self, server, api_info):
+        session = self.sessions.get(server)
+        if session is None or session.api_info is not api_info:
+            session = self.sessions[server] = AternosSession(api_info)
+        return session
+
+    def start(self, server, api_info, progress):
+        return self.run('start', server, api_info, progress)
+
+    def stop(self, server, api_info, progress):
+        return self.run('stop', server, api_info, progress)
+
+    def run(self, action, server, api_info, progress):
+        operation = self.operations.get(server)
+        if operation is not None and operation.action == action:
+            # Repeated requests follow the one already in flight instead of hitting Aternos again
+            operation.callbacks.append(progress)
+            progress(operation.state or f'Already trying to {action} the server...', False)
+            return False
+        if operation is not None:
+            # The old progress messages are closed off instead of being left at their last step
+            self.notify(operation, f'Cancelled by !{action}.', True)
+            operation.task.cancel()
+
+        operation = AternosOperation(action)
+        operation.callbacks.append(progress)
+        self.operations[server] = operation
+        operation.task = asyncio.ensure_future(self.execute(operation, server, api_info))
+        return True
+
+    def notify(self, operation, text, done=False):
+        operation.state = text
+        for callback in operation.callbacks:
+            try:
+                callback(text, done)
+            except Exception as e:
+                print('Error reporting Aternos progress: ' + str(e))
+
+    async def execute(self, operation, server, api_info):
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        want_running = operation.action == 'start'
+        try:
+            params = {'headstart': 0} if want_running else None
+            status, body = await self.get_session(server, api_info).request(operation.action, params)
+            try:
+                result = json.loads(body)
+            except ValueError:
+                result = {}
+            metrics.incr('aternos_requests_total', label=operation.action)
+            if status != 200 or result.get('success') is False:
+                print(f"Aternos refused to {operation.action}: {status} {result.get('error')}")
+                self.notify(operation, f"Aternos refused to {operation.action}: {result.get('error') or status}", True)
+                return
+
+            state = None
+            while loop.time() - started < self.limit:
+                await asyncio.sleep(self.interval)
+                _, _, raw = await probe_server(server, self.poller.timeout, self.poller.resolver)
+                if is_running(raw) == want_running:
+                    self.notify(operation, f"Server {'started' if want_running else 'stopped'} after {loop.time() - started:.0f}s.", True)
+                    return
+                if describe(raw) != state:
+                    state = describe(raw)
+                    self.notify(operation, f"{'Starting' if want_running else 'Stopping'} server: {state}")
+            self.notify(operation, f"Gave up waiting for the server to {operation.action} after {self.limit:.0f}s.", True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print('error running aternos ' + operation.action + ': ' + str(e))
+            self.notify(operation, f'Error trying to {operation.action} server.', True)
+        finally:
+            if self.operations.get(server) is operation:
+                del self.operations[server]
+
+    async def close(self):
+        for operation in list(self.operations.values()):
+            operation.task.cancel()
+        self.operations.clear()
+        for session in self.sessions.values():
+            await session.close()
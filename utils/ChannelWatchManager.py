@@ -1,13 +1,36 @@
 import discord
-from mcstatus import MinecraftServer
-from aternosapi import AternosAPI
+from mcstatus.pinger import PingResponse
 import dropbox
+import asyncio
 import os
 import json
-import requests
+import time
 import string
 import random
 
+# A new status has to hold for this many probes before it is posted, so flapping servers stay quiet
+CHANGE_CYCLES = max(1, int(os.environ.get('CREPESBOT_CHANGE_CYCLES', 2)))
+# Busy servers move by a few players every probe, a count within this share of the posted one has to hold
+# still for CHANGE_CYCLES probes before it is posted instead of settling while it keeps moving
+PLAYER_TOLERANCE_RATIO = float(os.environ.get('CREPESBOT_PLAYER_TOLERANCE_RATIO', 0.1))
+# Servers only get the fast poll interval for this many unsettled probes in a row, busy or flapping
+# servers fall back to the normal interval instead of being probed at the minimum forever
+MAX_FAST_CYCLES = 4
+# The player sample is only complete, and so only worth comparing, on servers this small
+SAMPLE_SIZE = 12
+# Between full status requests a TCP connect is enough to tell nothing has changed
+FULL_INTERVAL = float(os.environ.get('CREPESBOT_FULL_INTERVAL', 300))
+
+from utils.StatusPoller import create_poller
+from utils.Probe import probe_tiered, status_digest
+from utils.ServerRegistry import ServerRegistry, normalize_address
+from utils.StatusMessages import StatusMessageTracker
+from utils.WriteBehind import WriteBehindSaver
+from utils.Storage import create_storage
+from utils.StatusHistory import StatusHistory
+from utils.AternosControl import AternosControl
+from utils.Metrics import metrics
+
 class DropBoxManager:
     def __init__(self):
         self.dbx = None
@@ -29,21 +52,30 @@ class DropBoxManager:
             if self.connected:
                 with open(filename, "rb") as file_contents:
                     self.dbx.files_upload(file_contents.read(), '/' + filename, mode=dropbox.files.WriteMode.overwrite)
+            return True
         except Exception as e:
             print('Error uploading file: ' + filename)
             print(e)
+        return False
 
     def download(self, filename):
         try:
             if self.connected:
                 self.dbx.files_download_to_file(filename, '/' + filename)
-            data = ''
-            with open(filename, 'r') as myfile:
-                data = myfile.read()
-            return data
         except Exception as e:
             print('Error downloading file: ' + filename)
             print(e)
+        return self.read_local(filename)
+
+    def read_local(self, filename):
+        try:
+            with open(filename, 'r') as myfile:
+                return myfile.read()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print('Error reading file: ' + filename)
+            print(e)
         return '{}'
 
 class ChannelPayload:
@@ -52,97 +84,303 @@ class ChannelPayload:
         self.aternos = aternos
 
 class ChannelManager:
-    def __init__(self):
+    def __init__(self, storage=None):
+        # Keyed by channel id, holding the whole discord channel objects kept every guild's state alive
         self.channels = {}
+        self.shards = {}
+        self.shard_count = 1
+        self.unbound = {}
+        self.refreshes = {}
         self.dbx_manager = DropBoxManager()
+        self.storage = storage if storage is not None else create_storage()
+        self.saver = WriteBehindSaver(self.dbx_manager, "ServerWatchlist.json")
+        self.remote_ready = False
+        self.save_held = False
         self.aternos_api_info = None
+        self.poller = create_poller()
+        self.registry = ServerRegistry(self.poller)
+        self.aternos = AternosControl(self.poller)
 
     def add_server(self, channel, server):
-        if channel not in self.channels:
-            self.channels[channel] = Channel(channel)
-            self.channels[channel].set_aternos_api_info(self.aternos_api_info)
-
-        self.channels[channel].add_server(server)
-        self.save()
+        return self.add_servers(channel, [server])
+
+    def get_shard_id(self, channel):
+        guild = getattr(channel, 'guild', None)
+        if guild is None:
+            return 0
+        return (guild.id >> 22) % self.shard_count
+
+    def track(self, wrapper):
+        wrapper.shard_id = self.get_shard_id(wrapper.channel)
+        self.channels[wrapper.channel_id] = wrapper
+        self.shards.setdefault(wrapper.shard_id, {})[wrapper.channel_id] = wrapper
+
+    def get_or_create(self, channel):
+        if channel.id not in self.channels:
+            # A restored channel that bind() hasn't reached yet is adopted, never shadowed by a new one
+            wrapper = self.unbound.pop(channel.id, None)
+            if wrapper is not None:
+                wrapper.channel = channel
+            else:
+                wrapper = Channel(channel, self.registry, channel.id)
+            self.track(wrapper)
+        return self.channels[channel.id]
+
+    def get_shards(self):
+        shards = {}
+        for shard_id, channels in self.shards.items():
+            shards[shard_id] = [c.channel for c in channels.values()]
+        return shards
+
+    def add_servers(self, channel, servers):
+        self.get_or_create(channel)
+
+        added = []
+        for server in servers:
+            name = self.channels[channel.id].add_server(server)
+            if name is not None:
+                added.append(name)
+        if len(added) > 0:
+            # One storage transaction and one snapshot per batch, however many servers it has
+            self.storage.add_servers(channel.id, added)
+            self.save()
+            # Servers already tracked for another channel are posted here without waiting for their next probe
+            self.wake()
+        return added
 
     def set_aternos_server(self, channel, server):
-        if channel not in self.channels:
-            self.channels[channel] = Channel(channel)
-            self.channels[channel].set_aternos_api_info(self.aternos_api_info)
+        if self.aternos_api_info is not None and server not in self.aternos_api_info:
+            raise Exception('Unknown Aternos server: ' + server)
+        self.get_or_create(channel)
 
-        self.channels[channel].set_aternos_server(server)
+        self.channels[channel.id].set_aternos_server(server)
+        self.storage.set_aternos_server(channel.id, self.channels[channel.id].get_aternos_server())
         self.save()
 
     def get_aternos_server(self, channel):
-        return self.channels[channel].get_aternos_server()
+        return self.channels[channel.id].get_aternos_server()
+
+    def get_aternos_api_info(self, channel):
+        server = self.channels[channel.id].get_aternos_server()
+        if len(server) == 0 or self.aternos_api_info is None or server not in self.aternos_api_info:
+            raise Exception('No Aternos server set for this channel')
+        return server, self.aternos_api_info[server]
 
-    def start_aternos_server(self, channel):
-        self.channels[channel].start_aternos_server()
+    def start_aternos_server(self, channel, progress):
+        server, api_info = self.get_aternos_api_info(channel)
+        return self.aternos.start(server, api_info, progress)
 
-    def stop_aternos_server(self, channel):
-        self.channels[channel].stop_aternos_server()
+    def stop_aternos_server(self, channel, progress):
+        server, api_info = self.get_aternos_api_info(channel)
+        return self.aternos.stop(server, api_info, progress)
 
     def remove_server(self, channel, server):
-        if channel in self.channels:
-            self.channels[channel].remove_server(server)
-            self.save()
+        return self.remove_servers(channel, [server])
+
+    def remove_servers(self, channel, servers):
+        removed = []
+        if channel.id in self.channels:
+            for server in servers:
+                name = self.channels[channel.id].remove_server(server)
+                if name is not None:
+                    removed.append(name)
+            if len(removed) > 0:
+                self.storage.remove_servers(channel.id, removed)
+                self.save()
+        return removed
 
     def get_watchlist(self, channel):
         watchlist = []
-        if channel in self.channels:
-            watchlist = self.channels[channel].get_watchlist()
+        if channel.id in self.channels:
+            watchlist = self.channels[channel.id].get_watchlist()
         return watchlist
 
-    def get_status_embeds(self, channel):
-        if channel in self.channels:
-            return self.channels[channel].get_status_embeds()
+    async def update_due_statuses(self):
+        await self.registry.refresh_due()
+
+    async def wait_until_due(self):
+        await self.registry.wait_until_due()
+
+    def get_cached_servers(self, channel):
+        # Answers straight from the registry, stale entries are revalidated in the background
+        if channel.id not in self.channels:
+            return []
+        self.revalidate(channel)
+        return self.channels[channel.id].mark_seen()
+
+    def revalidate(self, channel):
+        servers = self.channels[channel.id].get_servers()
+        if channel.id in self.refreshes or all(self.registry.is_fresh(normalize_address(s.server), full=True) for s in servers):
+            metrics.incr('status_revalidations_skipped_total')
+            return
+        metrics.incr('status_revalidations_total')
+        task = self.refreshes[channel.id] = asyncio.ensure_future(self.registry.refresh(servers))
+        task.add_done_callback(lambda t: self.revalidated(channel, t))
+
+    def revalidated(self, channel, task):
+        self.refreshes.pop(channel.id, None)
+        if not task.cancelled() and task.exception() is not None:
+            print('Error refreshing status: ' + str(task.exception()))
+        # The background loop posts whatever changed, like after a scheduled poll
+        self.wake()
+
+    def get_status_json(self):
+        now = time.monotonic()
+        servers = {}
+        for address, status in self.registry.servers.items():
+            servers[address] = status.to_dict()
+            updated_at = self.registry.updated_at.get(address)
+            servers[address]['age'] = round(now - updated_at, 1) if updated_at is not None else None
+        channels = {}
+        for channel in self.channels.values():
+            channels[channel.channel_id] = list(channel.mc_servers)
+        return json.dumps({'servers': servers, 'channels': channels})
+
+    def get_changed_servers(self, channel):
+        if channel.id in self.channels:
+            return self.channels[channel.id].get_changed_servers()
         return []
 
-    def get_updated_status_embeds(self, channel):
-        if channel in self.channels:
-            return self.channels[channel].get_updated_status_embeds()
+    def get_servers(self, channel):
+        if channel.id in self.channels:
+            return self.channels[channel.id].get_servers()
         return []
 
+    def get_histories(self, channel, server=None):
+        histories = []
+        if channel.id in self.channels:
+            if server is None:
+                servers = self.channels[channel.id].get_servers()
+            else:
+                servers = [s for s in [self.channels[channel.id].get_server(server)] if s is not None]
+            for s in servers:
+                histories.append((s.server, s.history))
+        return histories
+
+    def get_status_tracker(self, channel):
+        if channel.id in self.channels:
+            return self.channels[channel.id].status_messages
+        return StatusMessageTracker()
+
     def get_json(self):
         content = {}
-        for channel in self.channels:
-            watchlist = self.channels[channel].get_watchlist()
-            aternos = self.channels[channel].get_aternos_server()
+        for channel in list(self.channels.values()) + list(self.unbound.values()):
+            watchlist = channel.get_watchlist()
+            aternos = channel.get_aternos_server()
             if len(watchlist) > 0 or len(aternos) > 0:
-                content[channel.id] = ChannelPayload(watchlist, aternos)
+                content[channel.channel_id] = ChannelPayload(watchlist, aternos)
         return json.dumps(content, default=lambda o: o.__dict__)
 
     def save(self):
-        print('save')
-        print('json: ' + self.get_json())
-        self.dbx_manager.upload("ServerWatchlist.json", self.get_json())
-
-    async def load(self, bot):
-        print(bot)
+        # The local store already has the change, Dropbox only receives debounced snapshots
+        if not self.dbx_manager.connected:
+            return
+        if not self.remote_ready:
+            # Held until the Dropbox snapshot has been read, a partial watchlist would otherwise overwrite it
+            self.save_held = True
+            return
+        self.saver.schedule(self.get_json)
+
+    async def close(self):
+        for task in list(self.refreshes.values()):
+            task.cancel()
+        self.poller.cancel()
+        self.registry.close()
+        await self.aternos.close()
+        await self.saver.close()
+        self.storage.close()
+
+    def restore(self):
+        # Local state only, no network, so probing can start before the gateway is even up
+        start = time.perf_counter()
         try:
-            raw_json = self.dbx_manager.download("aternos.json")
-            self.aternos_api_info = json.loads(raw_json)
+            self.aternos_api_info = json.loads(self.dbx_manager.read_local("aternos.json"))
         except Exception as e:
-            print('Error getting aternos.json' + str(e))
+            print('Error reading local aternos.json' + str(e))
+        state = {}
         try:
-            raw_json = self.dbx_manager.download("ServerWatchlist.json")
-            parsed_json = json.loads(raw_json)
-            for channel_id in parsed_json:
-                print(channel_id)
-                channel = bot.get_channel(int(channel_id))
-                print(channel)
-                watchlist = parsed_json[channel_id]['watchlist']
-                print(watchlist)
-                self.channels[channel] = Channel(channel)
-                self.channels[channel].set_aternos_api_info(self.aternos_api_info)
-                for server in watchlist:
-                    self.channels[channel].add_server(server)
-                aternos = parsed_json[channel_id]['aternos']
-                print(aternos)
-                self.channels[channel].set_aternos_server(aternos)
+            state = self.storage.load()
+            for channel_id in state:
+                self.restore_channel(channel_id, state[channel_id])
         except Exception as e:
-            print('Error downloadinging ServerWatchlist')
+            print('Error restoring ServerWatchlist')
             print(e)
+        metrics.set('startup_restore_seconds', time.perf_counter() - start)
+        print(f'Restored {len(state)} channels from local storage in {time.perf_counter() - start:.3f}s')
+        return len(state) > 0
+
+    def restore_channel(self, channel_id, payload):
+        channel = Channel(None, self.registry, int(channel_id))
+        for server in payload['watchlist']:
+            channel.add_server(server)
+        channel.set_aternos_server(payload['aternos'])
+        self.unbound[int(channel_id)] = channel
+
+    def merge_channel(self, channel_id, payload):
+        channel = self.channels.get(channel_id) or self.unbound.get(channel_id)
+        if channel is None:
+            self.restore_channel(channel_id, payload)
+            return
+        for server in payload['watchlist']:
+            channel.add_server(server)
+        if len(channel.get_aternos_server()) == 0:
+            channel.set_aternos_server(payload['aternos'])
+
+    def bind(self, bot, report=True):
+        # Sharded clients call this as each shard becomes ready, channels of later shards stay unbound until then
+        self.shard_count = bot.shard_count or 1
+        for channel_id in list(self.unbound):
+            channel = bot.get_channel(channel_id)
+            if channel is not None:
+                self.unbound[channel_id].channel = channel
+                self.track(self.unbound.pop(channel_id))
+        if report and len(self.unbound) > 0:
+            print('Channels not found: ' + ', '.join(str(c) for c in self.unbound))
+
+    async def refresh_remote(self, bot, seed_watchlist):
+        try:
+            await self.download_remote(bot, seed_watchlist)
+        finally:
+            self.remote_ready = True
+            if self.save_held:
+                self.save_held = False
+                self.save()
+
+        # Warm the SRV cache for every watched server in one concurrent pass
+        await self.poller.resolver.resolve_many([s.server for s in self.registry.servers.values()])
+
+    async def download_remote(self, bot, seed_watchlist):
+        loop = asyncio.get_event_loop()
+        downloads = [loop.run_in_executor(None, self.dbx_manager.download, "aternos.json")]
+        if seed_watchlist:
+            downloads.append(loop.run_in_executor(None, self.dbx_manager.download, "ServerWatchlist.json"))
+        # Both downloads run at the same time, and neither holds up polling or posting
+        results = await asyncio.gather(*downloads, return_exceptions=True)
+        try:
+            self.aternos_api_info = json.loads(results[0])
+        except Exception as e:
+            print('Error getting aternos.json' + str(e))
+        if seed_watchlist:
+            try:
+                parsed_json = json.loads(results[1])
+                if len(parsed_json) > 0:
+                    # Nothing was restored locally (e.g. a fresh dyno), so the last Dropbox snapshot is the watchlist.
+                    # Commands may already have added servers while it downloaded, those are kept on top of it
+                    added_meanwhile = len(self.storage.load()) > 0
+                    for channel_id in parsed_json:
+                        self.merge_channel(int(channel_id), parsed_json[channel_id])
+                    self.storage.replace_all(json.loads(self.get_json()))
+                    self.bind(bot)
+                    self.registry.scheduler.wake()
+                    if not added_meanwhile:
+                        # Only state that actually came from Dropbox is known to be there already
+                        self.saver.mark_clean(self.get_json())
+            except Exception as e:
+                print('Error downloading ServerWatchlist')
+                print(e)
+
+    def wake(self):
+        self.registry.scheduler.wake()
         
 
         #proxyDict = {"http"  : os.environ.get('FIXIE_URL', ''), "https" : os.environ.get('FIXIE_URL', '')}
@@ -196,137 +434,232 @@ class AternosAPIHelper:
 
 
 class Channel:
-    def __init__(self, channel):
+    __slots__ = ('channel', 'channel_id', 'shard_id', 'registry', 'mc_servers', 'names', 'seen_generations', 'status_messages', 'aternos_server')
+
+    def __init__(self, channel, registry, channel_id):
         self.channel = channel
-        self.mc_server_list = []
+        self.channel_id = channel_id
+        self.shard_id = 0
+        self.registry = registry
+        # Keyed by normalized address, dicts keep insertion order so the watchlist order is preserved
+        self.mc_servers = {}
+        # Each channel keeps the spelling it was given, whichever channel subscribed to the shared status first
+        self.names = {}
+        self.seen_generations = {}
+        self.status_messages = StatusMessageTracker()
         self.aternos_server = ''
-        self.aternos_api = None
-        self.aternos_api_info = None
-
-    def set_aternos_api_info(self, aternos_api_info):
-        self.aternos_api_info = aternos_api_info
 
     def add_server(self, server):
-        if server not in self.mc_server_list:
-            self.mc_server_list.append(ServerStatus(server))
+        address = normalize_address(server)
+        if len(address) == 0 or address in self.mc_servers:
+            return None
+        status = self.mc_servers[address] = self.registry.subscribe(server, self, ServerStatus)
+        self.names[address] = server.strip()
+        # Never matches changed_at, so this channel posts the server on its first look even if it's already tracked elsewhere
+        self.seen_generations[status] = -1
+        return self.names[address]
     
     def set_aternos_server(self, server):
-        print('set server: ' + server)
-        if self.aternos_api_info is not None and len(server) > 0:
+        # The Aternos session itself is only created on the first !start or !stop
+        if len(server) > 0:
             self.aternos_server = server
-            api_info = self.aternos_api_info[self.aternos_server]
-            try:
-                self.aternos_api = AternosAPI(api_info['header_cookie'], api_info['cookie'], api_info['asec'])
-                print('Check: ' + str(self.aternos_api.CheckVaildInput()))
-            except Exception as e:
-                print('aternos api error' + str(e))
 
     def get_aternos_server(self):
         return self.aternos_server
 
-    def start_aternos_server(self):
-        try:
-            print('starting')
-            print(self.aternos_api)
-            if self.aternos_api is not None:
-                #self.aternos_api.StartServer()
-
-                proxyDict = {"http"  : os.environ.get('FIXIE_URL', ''), "https" : os.environ.get('FIXIE_URL', '')}
-                api_info = self.aternos_api_info[self.aternos_server]
-                cookies = {}
-                cookies['ATERNOS_SESSION'] = api_info['cookie']
-                headers = {}
-                headers['User-Agent'] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:72.0) Gecko/20100101 Firefox/72.0"
-                headers['Cookie'] = api_info['header_cookie']
-                startserver = requests.get(url=f"https://aternos.org/panel/ajax/start.php?headstart=0&SEC={api_info['asec']}", proxies=proxyDict, cookies=cookies, headers=headers)
-                print(startserver)
-                print(startserver.text)
-                print(startserver.json())
-        except Exception as e:
-            print('error starting: ' + str(e))
-            raise e
-
-    def stop_aternos_server(self):
-        if self.aternos_api is not None:
-            self.aternos_api.StopServer()
-
     def remove_server(self, server):
-        server_to_remove = None
-        for s_status in self.mc_server_list:
-            if s_status.server == server:
-                server_to_remove = s_status
-                break
+        address = normalize_address(server)
+        server_to_remove = self.mc_servers.pop(address, None)
+        if server_to_remove is None:
+            return None
+        self.seen_generations.pop(server_to_remove, None)
+        self.registry.unsubscribe(server, self)
+        return self.names.pop(address)
+
+    def get_server(self, server):
+        return self.mc_servers.get(normalize_address(server))
 
-        if server_to_remove is not None:
-            self.mc_server_list.remove(server_to_remove)
+    def get_servers(self):
+        return list(self.mc_servers.values())
 
     def get_watchlist(self):
-        watchlist = []
-        for s in self.mc_server_list:
-            watchlist.append(s.server)
-        return watchlist
+        return list(self.names.values())
+
+    def mark_seen(self):
+        for server in self.mc_servers.values():
+            self.seen_generations[server] = server.changed_at
+        return self.get_servers()
 
-    def get_status_embeds(self):
-        embeds = []
-        for server in self.mc_server_list:
-            server.update_status()
-            em = server.get_embed()
-            if em is not None:
-                embeds.append(em)
-        return embeds
-
-    def get_updated_status_embeds(self):
-        embeds = []
-        for server in self.mc_server_list:
-            server.update_status()
-            if server.is_status_changed():
-                em = server.get_embed()
-                if em is not None:
-                    embeds.append(em)
-        return embeds
+    def get_changed_servers(self):
+        changed = []
+        for server in self.mc_servers.values():
+            # Shared statuses may have settled on a new state more than once since this channel last looked
+            if server.generation > 0 and self.seen_generations.get(server) != server.changed_at:
+                self.seen_generations[server] = server.changed_at
+                changed.append(server)
+        return changed
 
 
 class ServerStatus:
+    __slots__ = ('server', 'online', 'status', 'query', 'aternos_on', 'generation', 'history', 'digest', 'stable_digest',
+                 'pending_count', 'unsettled', 'changed', 'changed_at', 'embed', 'full_at')
+
     def __init__(self, server):
         self.server = server
         self.online = False
-        self.prev_online_state = False
         self.status = None
-        self.prev_status = None
+        self.query = None
+        self.aternos_on = False
+        self.generation = 0
+        self.history = StatusHistory()
+        self.digest = None
+        self.stable_digest = None
+        self.pending_count = 0
+        self.unsettled = 0
+        self.changed = False
+        self.changed_at = 0
+        self.embed = None
+        self.full_at = 0.0
 
     def is_status_changed(self):
-        online_change = (self.online != self.prev_online_state)
+        return self.changed
 
-        status_change = False
-        if self.prev_status is None and self.status is not None:
-            status_change = True
-        elif self.prev_status is not None and self.status is not None:
-            status_change = (self.prev_status.players.online != self.status.players.online)
+    def is_pending(self):
+        return self.pending_count > 0
 
-        return (online_change or status_change)
+    def wants_fast_poll(self):
+        return (self.changed or self.is_pending()) and self.unsettled <= MAX_FAST_CYCLES
 
-    def update_status(self):
-        self.prev_online_state = self.online
-        self.prev_status = self.status
-        aternos_on = False
-        try:
-            mc_server = MinecraftServer.lookup(self.server)
-            if 'aternos' in self.server and mc_server.host != self.server:
-                aternos_on = True
-            self.status = mc_server.status()
-            #self.query = mc_server.query()
-            print('o: ' + self.status.players.online)
-            print('m: ' + self.status.max)
-            #if self.status.players.online > 0 and self.status.players.online < 50:
-                #self.online = True
-            #else:
-                #self.online = False
-        except:
-            self.online = False
-        if aternos_on:
+    @staticmethod
+    def digests_match(digest, stable):
+        online, players, version, motd, sample = digest
+        stable_online, stable_players, stable_version, stable_motd, stable_sample = stable
+        if online != stable_online or version != stable_version or motd != stable_motd:
+            return False
+        if players != stable_players:
+            return False
+        return players > SAMPLE_SIZE or sample == stable_sample
+
+    @staticmethod
+    def is_minor_change(digest, stable):
+        online, players, version, motd, _ = digest
+        stable_online, stable_players, stable_version, stable_motd, _ = stable
+        if online != stable_online or version != stable_version or motd != stable_motd:
+            return False
+        return players > SAMPLE_SIZE and abs(players - stable_players) <= int(stable_players * PLAYER_TOLERANCE_RATIO)
+
+    def update_digest(self, digest):
+        previous = self.digest
+        if digest != previous:
+            self.embed = None
+        self.digest = digest
+        self.changed = False
+        if self.stable_digest is not None and ServerStatus.digests_match(digest, self.stable_digest):
+            if self.pending_count > 0:
+                metrics.incr('status_changes_suppressed_total')
+                self.unsettled += 1
+            else:
+                self.unsettled = 0
+            self.pending_count = 0
+            return
+        if self.stable_digest is not None and ServerStatus.is_minor_change(digest, self.stable_digest):
+            if previous is None or previous[1] != digest[1]:
+                # A small move on a busy server only counts once the new count has held still
+                self.pending_count = 0
+        self.unsettled += 1
+        self.pending_count += 1
+        # Settles on the latest digest once it has differed from the posted one for long enough, even if it kept
+        # moving in the meantime. The very first result is posted straight away, there's nothing to flap from yet
+        if self.pending_count >= CHANGE_CYCLES or self.stable_digest is None:
+            self.stable_digest = digest
+            self.pending_count = 0
+            self.changed = True
+            self.changed_at = self.generation
+            metrics.incr('status_changes_total')
+
+    def set_offline(self):
+        self.online = self.aternos_on
+
+    def get_expected(self, full=False):
+        # The cheap check only stands in for a full status while nothing is in flux
+        if full or self.generation == 0 or self.aternos_on or self.is_pending() or time.monotonic() - self.full_at >= FULL_INTERVAL:
+            return None
+        return self.online
+
+    async def update_status(self, timeout, resolver, full=False):
+        tier, online, aternos_on, raw = await probe_tiered(self.server, self.get_expected(full), timeout, resolver)
+        self.apply_tier(tier, online, aternos_on, raw)
+        return tier
+
+    def apply_tier(self, tier, online, aternos_on, raw):
+        if tier == 'tcp':
+            self.apply_reachable()
+        else:
+            self.apply_result(online, aternos_on, raw)
+
+    def apply_reachable(self):
+        # Same reachability as the last full status, so that status (and its digest) still stands
+        self.generation += 1
+        self.update_digest(self.digest)
+        self.history.record(self.online, self.get_player_count())
+
+    def apply_result(self, online, aternos_on, raw):
+        self.generation += 1
+        self.full_at = time.monotonic()
+        self.aternos_on = aternos_on
+        if online:
+            self.status = PingResponse(raw)
             self.online = True
-        
+        else:
+            self.set_offline()
+            self.apply_query(None)
+        self.update_digest(status_digest(self.online, raw))
+        self.history.record(self.online, self.get_player_count())
+
+    def apply_query(self, query):
+        # Query replies arrive after the digest is taken, a different player list just invalidates the embed
+        if query != self.query:
+            self.query = query
+            self.embed = None
+
+    def get_player_names(self):
+        if self.query is not None:
+            return self.query['names']
+        if self.status is not None and self.status.players is not None and self.status.players.sample is not None:
+            return [p.name for p in self.status.players.sample]
+        return []
+
+    def get_version(self):
+        if self.query is not None and len(self.query['version']) > 0:
+            if len(self.query['software']) > 0:
+                return f"{self.query['version']} ({self.query['software']})"
+            return self.query['version']
+        if self.status is not None and self.status.version is not None:
+            return self.status.version.name
+        return ''
+
+    def to_dict(self):
+        return {
+            'server': self.server,
+            'online': self.online,
+            'checked': self.generation > 0,
+            'players': self.get_player_count(),
+            'version': self.get_version(),
+            'names': self.get_player_names(),
+        }
+
+    def get_player_count(self):
+        if self.online and self.status is not None and self.status.players is not None:
+            return self.status.players.online
+        return 0
+
     def get_embed(self):
+        # The digest covers everything shown, so the embed is only rebuilt when it changes
+        if self.embed is None:
+            self.embed = self.build_embed()
+        return self.embed
+
+    def build_embed(self):
         if(self.online):
             color=0x00ff00
         else:
@@ -334,13 +667,21 @@ class ServerStatus:
 
         embed = discord.Embed(title=f'Minecraft Server: {self.server}', color=color)
         embed.set_thumbnail(url='https://i.imgur.com/lxtYZIR.gif')
-        if(self.online):
+        if self.generation == 0:
+            embed.add_field(name="Status", value="Checking...", inline=False)
+        elif(self.online):
             embed.add_field(name="Status", value="Online", inline=True)
-            #embed.add_field(name="Version", value=f"{self.query.software.version}", inline=True)
+            version = self.get_version()
+            if len(version) > 0:
+                embed.add_field(name="Version", value=version[:1024], inline=True)
             if self.status is not None and self.status.players is not None:
                 embed.add_field(name="# Online", value=f"{self.status.players.online}", inline=False)
-            #if(self.status.players.online > 0):
-                #embed.add_field(name="Players Online", value="\n".join(self.query.players.names), inline=False)
+            names = self.get_player_names()
+            if len(names) > 0:
+                listing = "\n".join(names)
+                if len(listing) > 1024:
+                    listing = listing[:1000].rsplit("\n", 1)[0] + "\n..."
+                embed.add_field(name="Players Online", value=listing, inline=False)
         else:
             embed.add_field(name="Status", value="Offline", inline=False)
             embed.add_field(name="# Online", value=f"0", inline=True)
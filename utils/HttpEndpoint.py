@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+class HttpEndpoint:
+    def __init__(self, host=None, port=None):
+        if host is None:
+            host = os.environ.get('CREPESBOT_HTTP_HOST', '127.0.0.1')
+        if port is None:
+            port = int(os.environ.get('CREPESBOT_HTTP_PORT', 0))
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self.server = None
+
+    def is_enabled(self):
+        return self.port > 0
+
+    def add_route(self, path, handler):
+        self.routes[path] = handler
+
+    async def start(self):
+        if self.is_enabled() and self.server is None:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            print(f'HTTP endpoint listening on {self.host}:{self.port}')
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                status, content_type, body = 400, 'text/plain', 'Bad Request\n'
+            elif parts[0] != 'GET':
+                status, content_type, body = 405, 'text/plain', 'Method Not Allowed\n'
+            elif parts[1].split('?')[0] not in self.routes:
+                status, content_type, body = 404, 'text/plain', 'Not Found\n'
+            else:
+                try:
+                    content_type, body = self.routes[parts[1].split('?')[0]]()
+                    status = 200
+                except Exception as e:
+                    print('HTTP handler error: ' + str(e))
+                    status, content_type, body = 500, 'text/plain', 'Internal Server Error\n'
+            payload = body.encode('utf-8')
+            writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
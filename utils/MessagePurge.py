@@ -0,0 +1,101 @@
+import time
+import discord
+
+from utils.Metrics import metrics
+from utils.SendScheduler import PRIORITY_COMMAND, PRIORITY_BACKGROUND
+
+DISCORD_EPOCH = 1420070400000
+BULK_DELETE_LIMIT = 100
+# Discord refuses bulk deletes of messages older than 14 days, the margin covers clock skew
+BULK_DELETE_MAX_AGE = 14 * 24 * 3600 - 300
+
+def snowflake_ago(seconds):
+    # Comparing ids instead of created_at sidesteps naive/aware datetimes across discord.py versions
+    return max(0, int((time.time() - seconds) * 1000) - DISCORD_EPOCH) << 22
+
+class MessagePurge:
+    def __init__(self, channel, scheduler, limit, check=None, before=None, after=None, scan_limit=None, progress=None, report_every=2.0):
+        self.channel = channel
+        self.scheduler = scheduler
+        self.limit = limit
+        self.check = check
+        self.before = before
+        self.after = after
+        self.scan_limit = scan_limit
+        self.progress = progress
+        self.report_every = report_every
+        self.reported_at = 0.0
+        self.scanned = 0
+        self.bulk_deleted = 0
+        self.single_deleted = 0
+        self.failed = 0
+
+    def get_deleted(self):
+        return self.bulk_deleted + self.single_deleted
+
+    def report(self, done=False):
+        now = time.monotonic()
+        if self.progress is None or (not done and now - self.reported_at < self.report_every):
+            return
+        self.reported_at = now
+        text = f'Deleted {self.get_deleted()} of {self.limit} messages ({self.scanned} checked)'
+        if self.single_deleted > 0:
+            text += f', {self.single_deleted} one by one'
+        if self.failed > 0:
+            text += f', {self.failed} failed'
+        self.progress(('Done. ' if done else 'Clearing... ') + text, done)
+
+    async def run(self):
+        cutoff = snowflake_ago(BULK_DELETE_MAX_AGE)
+        chunk = []
+        before = discord.Object(id=self.before) if self.before is not None else None
+        after = discord.Object(id=self.after) if self.after is not None else None
+        matched = 0
+        # history() pages through the channel 100 messages at a time, only one chunk is ever held
+        async for message in self.channel.history(limit=self.scan_limit, before=before, after=after, oldest_first=False):
+            self.scanned += 1
+            if self.check is not None and not self.check(message):
+                continue
+            if message.id > cutoff:
+                chunk.append(message)
+                if len(chunk) == BULK_DELETE_LIMIT:
+                    await self.delete_bulk(chunk)
+                    chunk = []
+            else:
+                # Newest first, so everything from here on is too old for a bulk delete
+                if len(chunk) > 0:
+                    await self.delete_bulk(chunk)
+                    chunk = []
+                await self.delete_single(message)
+            matched += 1
+            self.report()
+            if matched >= self.limit:
+                break
+        if len(chunk) > 0:
+            await self.delete_bulk(chunk)
+        self.report(True)
+        metrics.incr('purge_deleted_total', self.get_deleted())
+        return self.get_deleted()
+
+    async def delete_bulk(self, messages):
+        if len(messages) == 1:
+            await self.delete_single(messages[0])
+            return
+        try:
+            await self.scheduler.submit(self.channel, lambda: self.channel.delete_messages(messages), priority=PRIORITY_COMMAND, route='delete')
+            self.bulk_deleted += len(messages)
+        except discord.HTTPException as e:
+            print('Bulk delete failed, deleting one by one: ' + str(e))
+            for message in messages:
+                await self.delete_single(message)
+
+    async def delete_single(self, message):
+        # Old messages go through their own rate limited route, behind status posts and commands
+        try:
+            await self.scheduler.submit(self.channel, lambda: message.delete(), priority=PRIORITY_BACKGROUND, route='delete_single')
+            self.single_deleted += 1
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            self.failed += 1
+            print('Error deleting message: ' + str(e))
@@ -0,0 +1,124 @@
+import bisect
+import os
+import time
+
+LABEL_NAMES = {'probe_seconds': 'server', 'discord_requests_total': 'route', 'send_jobs_total': 'route', 'probe_tier_total': 'tier', 'probe_tier_seconds': 'tier'}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+class Metrics:
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get('CREPESBOT_METRICS', '1') != '0'
+        self.enabled = enabled
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def incr(self, name, value=1, label=None):
+        if not self.enabled:
+            return
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, label=None):
+        if not self.enabled:
+            return
+        self.gauges[(name, label)] = value
+
+    def observe(self, name, value, label=None):
+        if not self.enabled:
+            return
+        key = (name, label)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+        if label is not None:
+            # Keep an unlabelled aggregate so totals don't need a scan over every label
+            self.observe(name, value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def forget(self, label):
+        for store in (self.counters, self.gauges, self.histograms):
+            for key in [k for k in store if k[1] == label]:
+                del store[key]
+
+    def get_counter(self, name, label=None):
+        return self.counters.get((name, label), 0)
+
+    def get_counter_total(self, name):
+        return sum(v for k, v in self.counters.items() if k[0] == name)
+
+    def get_histogram(self, name, label=None):
+        return self.histograms.get((name, label))
+
+    def get_gauge(self, name, label=None):
+        return self.gauges.get((name, label))
+
+    def collect(self):
+        for collector in self.collectors:
+            for name, value in collector().items():
+                self.gauges[(name, None)] = value
+
+    def get_slowest(self, name, limit=5):
+        ranked = [(h.quantile(0.95), label) for (n, label), h in self.histograms.items() if n == name and label is not None]
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        return ranked[:limit]
+
+    @staticmethod
+    def format_labels(name, label, le=None):
+        labels = []
+        if label is not None:
+            escaped = str(label).replace('\\', '\\\\').replace('"', '\\"')
+            labels.append(LABEL_NAMES.get(name, 'label') + '="' + escaped + '"')
+        if le is not None:
+            labels.append('le="' + le + '"')
+        return '{' + ','.join(labels) + '}' if len(labels) > 0 else ''
+
+    def render_prometheus(self):
+        self.collect()
+        lines = []
+        for (name, label), value in sorted(self.counters.items(), key=lambda i: (i[0][0], str(i[0][1]))):
+            lines.append(f'crepesbot_{name}{Metrics.format_labels(name, label)} {value}')
+        for (name, label), value in sorted(self.gauges.items(), key=lambda i: (i[0][0], str(i[0][1]))):
+            lines.append(f'crepesbot_{name}{Metrics.format_labels(name, label)} {value}')
+        for (name, label), histogram in sorted(self.histograms.items(), key=lambda i: (i[0][0], str(i[0][1]))):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'crepesbot_{name}_bucket{Metrics.format_labels(name, label, le)} {cumulative}')
+            lines.append(f'crepesbot_{name}_sum{Metrics.format_labels(name, label)} {histogram.total}')
+            lines.append(f'crepesbot_{name}_count{Metrics.format_labels(name, label)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+
+from utils.Metrics import metrics
+
+class PollScheduler:
+    def __init__(self, interval=None, min_interval=None, max_interval=None, backoff=2.0, jitter=0.1):
+        if interval is None:
+            interval = float(os.environ.get('CREPESBOT_POLL_INTERVAL', 60))
+        if min_interval is None:
+            min_interval = float(os.environ.get('CREPESBOT_POLL_MIN_INTERVAL', 15))
+        if max_interval is None:
+            max_interval = float(os.environ.get('CREPESBOT_POLL_MAX_INTERVAL', 900))
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.wakeup = None
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def push(self, address, due):
+        self.entries[address][0] = due
+        heapq.heappush(self.heap, (due, next(self.counter), address))
+
+    def add(self, address, now=None):
+        if address in self.entries:
+            return
+        if now is None:
+            now = time.monotonic()
+        self.entries[address] = [None, self.interval]
+        # Spread newly added servers a little so a reload doesn't probe everything at once
+        self.push(address, now + random.uniform(0, self.interval * self.jitter))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def remove(self, address):
+        # Heap entries are dropped lazily when they no longer match self.entries
+        self.entries.pop(address, None)
+
+    def pop_due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        due = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            when, _, address = heapq.heappop(self.heap)
+            entry = self.entries.get(address)
+            if entry is not None and entry[0] == when:
+                entry[0] = None
+                due.append(address)
+                metrics.observe('poll_lag_seconds', now - when)
+        return due
+
+    def reschedule(self, address, online, changed, now=None):
+        entry = self.entries.get(address)
+        if entry is None or entry[0] is not None:
+            return
+        if now is None:
+            now = time.monotonic()
+        interval = entry[1]
+        if changed:
+            interval = self.min_interval
+        elif not online:
+            interval = min(interval * self.backoff, self.max_interval)
+        elif interval < self.interval:
+            interval = min(interval * self.backoff, self.interval)
+        else:
+            interval = self.interval
+        entry[1] = interval
+        self.push(address, now + self.jittered(interval))
+
+    def get_next_delay(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        while len(self.heap) > 0:
+            when, _, address = self.heap[0]
+            entry = self.entries.get(address)
+            if entry is not None and entry[0] == when:
+                return max(0.0, when - now)
+            heapq.heappop(self.heap)
+        return self.interval
+
+    def get_wakeup(self):
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        return self.wakeup
+
+    def wake(self):
+        self.get_wakeup().set()
+
+    async def wait(self):
+        wakeup = self.get_wakeup()
+        try:
+            await asyncio.wait_for(wakeup.wait(), self.get_next_delay())
+        except asyncio.TimeoutError:
+            pass
+        # Consumed as the next cycle starts, a wake that arrives while a cycle is running isn't lost
+        wakeup.clear()
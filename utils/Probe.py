@@ -0,0 +1,66 @@
+import asyncio
+import json
+import zlib
+from mcstatus import MinecraftServer
+
+def compact_status(raw):
+    # The favicon is a base64 PNG and by far the largest part of a status reply
+    return {k: v for k, v in raw.items() if k != 'favicon'}
+
+def status_digest(online, raw):
+    # Everything a status post shows, boiled down to a small comparable tuple
+    if not online or raw is None:
+        return (online, 0, '', 0, 0)
+    players = raw.get('players') or {}
+    motd = zlib.crc32(json.dumps(raw.get('description', ''), sort_keys=True).encode('utf-8'))
+    sample = zlib.crc32('\n'.join(sorted(str(p.get('name', '')) for p in players.get('sample') or [])).encode('utf-8'))
+    return (True, players.get('online', 0), str((raw.get('version') or {}).get('name', '')), motd, sample)
+
+async def probe_reachable(server, timeout, resolver):
+    aternos_on = False
+    try:
+        host, port = await asyncio.wait_for(resolver.lookup(server), timeout)
+        if 'aternos' in server and host != server:
+            aternos_on = True
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.close()
+        return True, aternos_on
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        return False, aternos_on
+
+def probe_deadline(timeout):
+    # A tiered probe can take a lookup and a connect, then a lookup and a status request. One overall deadline
+    # keeps a host that starts dropping packets from costing every one of those timeouts
+    return timeout * 2
+
+async def probe_tiered(server, expect, timeout, resolver):
+    try:
+        return await asyncio.wait_for(probe_tiers(server, expect, timeout, resolver), probe_deadline(timeout))
+    except asyncio.TimeoutError:
+        return 'full', False, False, None
+
+async def probe_tiers(server, expect, timeout, resolver):
+    # expect is the last known online state, or None to go straight to a full status request
+    if expect is not None:
+        reachable, aternos_on = await probe_reachable(server, timeout, resolver)
+        # Aternos proxies accept connections for stopped servers too, only the full status can tell
+        if reachable == expect and not aternos_on:
+            return 'tcp', reachable, aternos_on, None
+    online, aternos_on, raw = await probe_server(server, timeout, resolver)
+    return 'full', online, aternos_on, raw
+
+async def probe_server(server, timeout, resolver):
+    aternos_on = False
+    try:
+        host, port = await asyncio.wait_for(resolver.lookup(server), timeout)
+        if 'aternos' in server and host != server:
+            aternos_on = True
+        mc_server = MinecraftServer(host, port)
+        status = await asyncio.wait_for(mc_server.async_status(), timeout)
+        return True, aternos_on, compact_status(status.raw)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        return False, aternos_on, None
@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import multiprocessing
+import threading
+import time
+import zlib
+
+from utils.Probe import probe_tiered, probe_deadline
+from utils.ResolverCache import ResolverCache
+from utils.ServerRegistry import normalize_address
+from utils.StatusPoller import record_probe
+
+def worker_main(requests, results, max_concurrency):
+    asyncio.run(worker_loop(requests, results, max_concurrency))
+
+async def worker_loop(requests, results, max_concurrency):
+    loop = asyncio.get_event_loop()
+    resolver = ResolverCache()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = set()
+
+    async def probe(batch_id, server, expect, timeout):
+        async with semaphore:
+            start = time.perf_counter()
+            tier, online, aternos_on, raw = await probe_tiered(server, expect, timeout, resolver)
+            elapsed = time.perf_counter() - start
+        # Results stream back one by one instead of waiting for the whole batch
+        results.put((batch_id, server, tier, online, aternos_on, raw, elapsed))
+
+    while True:
+        batch = await loop.run_in_executor(None, requests.get)
+        if batch is None:
+            break
+        batch_id, timeout, servers = batch
+        resolver.prune()
+        for server, expect in servers:
+            task = asyncio.ensure_future(probe(batch_id, server, expect, timeout))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    for task in list(tasks):
+        task.cancel()
+
+class ProcessPoller:
+    def __init__(self, workers, max_concurrency, timeout):
+        self.workers = max(1, workers)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        # Only used by the bot process to warm its cache, probing resolves inside the workers
+        self.resolver = ResolverCache()
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = [None] * self.workers
+        self.requests = [None] * self.workers
+        self.results = None
+        self.reader = None
+        self.loop = None
+        self.waiting = {}
+        self.counter = itertools.count()
+
+    def partition(self, server):
+        return zlib.crc32(normalize_address(server).encode('utf-8')) % self.workers
+
+    def start(self):
+        if self.results is None:
+            self.loop = asyncio.get_event_loop()
+            self.results = self.context.Queue()
+            self.reader = threading.Thread(target=self.read_results, args=(self.results, self.loop), daemon=True)
+            self.reader.start()
+        for i in range(self.workers):
+            if self.processes[i] is None or not self.processes[i].is_alive():
+                if self.processes[i] is not None:
+                    print('Restarting probe worker ' + str(i))
+                self.requests[i] = self.context.Queue()
+                self.processes[i] = self.context.Process(target=worker_main, args=(self.requests[i], self.results, self.max_concurrency), daemon=True)
+                self.processes[i].start()
+
+    def read_results(self, results, loop):
+        # Holds its own references, cancel() drops self.results while results may still be queued ahead of the None
+        while True:
+            result = results.get()
+            if result is None or loop.is_closed():
+                break
+            try:
+                loop.call_soon_threadsafe(self.deliver, result)
+            except RuntimeError:
+                # The loop closed between the check and the call
+                break
+
+    def deliver(self, result):
+        batch_id, server, tier, online, aternos_on, raw, elapsed = result
+        waiting = self.waiting.pop((batch_id, server), None)
+        if waiting is None:
+            return
+        server_status, future = waiting
+        server_status.apply_tier(tier, online, aternos_on, raw)
+        record_probe(server_status, elapsed, tier)
+        if not future.done():
+            future.set_result(None)
+
+    async def poll(self, servers, full=False):
+        self.start()
+        batch_id = next(self.counter)
+        batches = {}
+        futures = []
+        for server_status in servers:
+            future = self.loop.create_future()
+            self.waiting[(batch_id, server_status.server)] = (server_status, future)
+            # The tier is decided here, workers only see the expected reachability
+            batches.setdefault(self.partition(server_status.server), []).append((server_status.server, server_status.get_expected(full)))
+            futures.append(future)
+        for i, batch in batches.items():
+            self.requests[i].put((batch_id, self.timeout, batch))
+
+        try:
+            # Workers run max_concurrency probes at a time, each bounded by the probe deadline, plus slack for the round trip
+            waves = max([-(-len(batch) // self.max_concurrency) for batch in batches.values()] + [1])
+            await asyncio.wait_for(asyncio.gather(*futures), probe_deadline(self.timeout) * waves + 1)
+        except asyncio.TimeoutError:
+            print('Probe workers did not answer for ' + str(sum(1 for f in futures if f.cancelled())) + ' servers')
+        finally:
+            for server_status in servers:
+                self.waiting.pop((batch_id, server_status.server), None)
+
+    def cancel(self):
+        for _, future in self.waiting.values():
+            future.cancel()
+        self.waiting.clear()
+        for i in range(self.workers):
+            if self.processes[i] is not None and self.processes[i].is_alive():
+                self.requests[i].put(None)
+        if self.results is not None:
+            self.results.put(None)
+            self.results = None
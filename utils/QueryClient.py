@@ -0,0 +1,164 @@
+import asyncio
+import os
+import random
+import socket
+import struct
+import time
+
+from utils.Metrics import metrics
+
+MAGIC = b'\xfe\xfd'
+HANDSHAKE = 9
+STAT = 0
+# Session ids only use the low nibble of each byte, the protocol drops the rest
+SESSION_MASK = 0x0F0F0F0F
+
+def parse_full_stat(data):
+    # 11 bytes of 'splitnum' padding, key/value pairs, 10 more bytes of padding, then player names
+    data = data[11:]
+    info = {}
+    while True:
+        key, _, data = data.partition(b'\x00')
+        if len(key) == 0:
+            break
+        value, _, data = data.partition(b'\x00')
+        info[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+    names = []
+    for name in data[10:].split(b'\x00'):
+        if len(name) == 0:
+            break
+        names.append(name.decode('utf-8', 'replace'))
+    return {'version': info.get('version', ''), 'software': info.get('plugins', '').split(':')[0].strip(), 'names': names}
+
+class QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.received(data, addr)
+
+class QueryClient:
+    def __init__(self, timeout=None, token_ttl=None, retry_after=None, address_ttl=None):
+        if timeout is None:
+            timeout = float(os.environ.get('CREPESBOT_QUERY_TIMEOUT', 2))
+        if token_ttl is None:
+            # Servers rotate challenge tokens every 30 seconds
+            token_ttl = float(os.environ.get('CREPESBOT_QUERY_TOKEN_TTL', 25))
+        if retry_after is None:
+            retry_after = float(os.environ.get('CREPESBOT_QUERY_RETRY', 300))
+        if address_ttl is None:
+            address_ttl = float(os.environ.get('CREPESBOT_QUERY_ADDRESS_TTL', 300))
+        self.timeout = timeout
+        self.token_ttl = token_ttl
+        self.retry_after = retry_after
+        self.address_ttl = address_ttl
+        self.transport = None
+        self.pending = {}
+        self.tokens = {}
+        self.addresses = {}
+        self.failed = {}
+
+    async def get_transport(self):
+        if self.transport is None or self.transport.is_closing():
+            loop = asyncio.get_event_loop()
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: QueryProtocol(self), local_addr=('0.0.0.0', 0), family=socket.AF_INET)
+        return self.transport
+
+    def new_session(self):
+        while True:
+            session = random.getrandbits(32) & SESSION_MASK
+            if session not in self.pending:
+                return session
+
+    def received(self, data, addr):
+        if len(data) < 5:
+            return
+        session = struct.unpack('>i', data[1:5])[0]
+        future = self.pending.get(session)
+        # Replies are matched by session id alone, multi-homed hosts may answer from another address
+        if future is None or future.done() or data[0] not in (HANDSHAKE, STAT):
+            return
+        future.set_result(data)
+
+    def send(self, transport, kind, address, payload=b''):
+        session = self.new_session()
+        future = asyncio.get_event_loop().create_future()
+        self.pending[session] = future
+        transport.sendto(MAGIC + bytes([kind]) + struct.pack('>i', session) + payload, address)
+        return session, future
+
+    async def exchange(self, transport, requests):
+        # Every request in a round shares one deadline, unresponsive hosts time out together
+        sent = {key: self.send(transport, kind, address, payload) for key, (kind, address, payload) in requests.items()}
+        try:
+            if len(sent) > 0:
+                await asyncio.wait([future for _, future in sent.values()], timeout=self.timeout)
+            return {key: future.result() for key, (_, future) in sent.items() if future.done() and not future.cancelled()}
+        finally:
+            for session, future in sent.values():
+                future.cancel()
+                self.pending.pop(session, None)
+
+    async def resolve(self, host, port):
+        address, expires = self.addresses.get((host, port), (None, 0))
+        if address is None or expires <= time.monotonic():
+            infos = await asyncio.get_event_loop().getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            address = infos[0][4][:2]
+            self.addresses[(host, port)] = (address, time.monotonic() + self.address_ttl)
+        return address
+
+    def prune(self, now):
+        # Every entry carries its expiry, removed or renamed servers don't stay cached forever
+        for cache, expiry in ((self.addresses, lambda v: v[1]), (self.tokens, lambda v: v[1]), (self.failed, lambda v: v)):
+            for key in [k for k, v in cache.items() if expiry(v) <= now]:
+                del cache[key]
+
+    async def query_many(self, targets):
+        # targets maps a key to (host, port), the result maps keys that answered to their query info
+        now = time.monotonic()
+        self.prune(now)
+        targets = {k: t for k, t in targets.items() if self.failed.get(t, 0) <= now}
+        if len(targets) == 0:
+            return {}
+        start = time.perf_counter()
+        transport = await self.get_transport()
+        resolved = await asyncio.gather(*[self.resolve(host, port) for host, port in targets.values()], return_exceptions=True)
+        addresses = {k: a for k, a in zip(targets, resolved) if not isinstance(a, Exception)}
+
+        handshakes = {k: (HANDSHAKE, a, b'') for k, a in addresses.items() if self.tokens.get(a, (0, 0))[1] <= now}
+        for key, data in (await self.exchange(transport, handshakes)).items():
+            try:
+                self.tokens[addresses[key]] = (int(data[5:].split(b'\x00')[0]), now + self.token_ttl)
+            except ValueError:
+                pass
+
+        stats = {}
+        for key, address in addresses.items():
+            token = self.tokens.get(address)
+            if token is not None and token[1] > now:
+                stats[key] = (STAT, address, struct.pack('>i', token[0]) + b'\x00\x00\x00\x00')
+        replies = await self.exchange(transport, stats)
+
+        results = {}
+        for key, target in targets.items():
+            if key in replies:
+                try:
+                    results[key] = parse_full_stat(replies[key][5:])
+                    continue
+                except Exception as e:
+                    print('Error parsing query reply: ' + str(e))
+            if key in addresses and key not in handshakes:
+                # Most likely an expired token, handshake again next cycle
+                self.tokens.pop(addresses[key], None)
+            else:
+                # Query is often disabled, don't keep asking every cycle
+                self.failed[target] = now + self.retry_after
+        metrics.observe('query_batch_seconds', time.perf_counter() - start)
+        metrics.incr('query_replies_total', len(results))
+        metrics.incr('query_timeouts_total', len(targets) - len(results))
+        return results
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
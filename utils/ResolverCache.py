@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+import dns.asyncresolver
+import dns.exception
+
+from utils.Metrics import metrics
+
+DEFAULT_PORT = 25565
+
+class ResolverCache:
+    def __init__(self, negative_ttl=None, min_ttl=5, max_ttl=3600, max_concurrency=16):
+        if negative_ttl is None:
+            negative_ttl = float(os.environ.get('CREPESBOT_DNS_NEGATIVE_TTL', 30))
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        self.resolver = dns.asyncresolver.Resolver()
+        self.entries = {}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def split_address(address):
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            return host, int(port)
+        return address, None
+
+    async def lookup(self, address):
+        host, port = ResolverCache.split_address(address)
+        if port is not None:
+            # Explicit ports skip the SRV lookup, same as MinecraftServer.lookup
+            return host, port
+
+        entry = self.entries.get(host)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            metrics.incr('dns_cache_hits_total')
+            return entry[1], entry[2]
+        self.misses += 1
+        metrics.incr('dns_cache_misses_total')
+
+        # Concurrent lookups for the same name share a single query
+        future = self.pending.get(host)
+        if future is None:
+            future = asyncio.ensure_future(self.resolve_srv(host))
+            future.add_done_callback(lambda f: self.pending.pop(host, None))
+            self.pending[host] = future
+        return await asyncio.shield(future)
+
+    async def resolve_srv(self, host):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            try:
+                answer = await self.resolver.resolve('_minecraft._tcp.' + host, 'SRV')
+                record = answer[0]
+                result = (str(record.target).rstrip('.'), int(record.port))
+                ttl = min(max(answer.rrset.ttl, self.min_ttl), self.max_ttl)
+            except dns.exception.DNSException:
+                result = (host, DEFAULT_PORT)
+                ttl = self.negative_ttl
+        self.entries[host] = (time.monotonic() + ttl, result[0], result[1])
+        return result
+
+    async def resolve_many(self, addresses):
+        return await asyncio.gather(*[self.lookup(a) for a in addresses], return_exceptions=True)
+
+    def prune(self):
+        now = time.monotonic()
+        expired = [host for host, entry in self.entries.items() if entry[0] <= now]
+        for host in expired:
+            del self.entries[host]
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import discord
+
+from utils.Metrics import metrics
+
+PRIORITY_COMMAND = 0
+PRIORITY_STATUS = 1
+PRIORITY_BACKGROUND = 2
+
+class RouteBucket:
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate / self.per)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+class SendJob:
+    def __init__(self, factory, priority, route, key):
+        self.factory = factory
+        self.priority = priority
+        self.route = route
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_event_loop().create_future()
+
+class SendScheduler:
+    def __init__(self, rate=None, per=5.0, max_retries=3):
+        if rate is None:
+            rate = int(os.environ.get('CREPESBOT_SEND_RATE', 5))
+        self.rate = rate
+        self.per = per
+        self.max_retries = max_retries
+        self.queues = {}
+        self.pending = {}
+        self.buckets = {}
+        self.workers = {}
+        self.counter = itertools.count()
+        self.started = 0
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, channel, factory, priority=PRIORITY_STATUS, route='send', key=None):
+        # A queued job with the same key is replaced by the newest one, its callers share the result
+        if key is not None and (channel.id, key, priority) in self.pending:
+            job = self.pending[(channel.id, key, priority)]
+            job.factory = factory
+            self.merged += 1
+            return job.future
+
+        job = SendJob(factory, priority, route, key)
+        job.future.add_done_callback(SendScheduler.log_failure)
+        if key is not None:
+            self.pending[(channel.id, key, priority)] = job
+        heapq.heappush(self.queues.setdefault(channel.id, []), (priority, next(self.counter), job))
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.ensure_future(self.drain(channel.id))
+        return job.future
+
+    async def drain(self, channel_id):
+        queue = self.queues[channel_id]
+        try:
+            while len(queue) > 0:
+                _, _, job = heapq.heappop(queue)
+                if job.key is not None:
+                    self.pending.pop((channel_id, job.key, job.priority), None)
+                await self.get_bucket(channel_id, job.route).acquire()
+                wait = time.monotonic() - job.enqueued_at
+                self.started += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                metrics.observe('send_wait_seconds', wait)
+                metrics.incr('send_jobs_total', label=job.route)
+                await self.run(job)
+        finally:
+            del self.workers[channel_id]
+            if len(queue) == 0:
+                del self.queues[channel_id]
+
+    async def run(self, job):
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await job.factory()
+                self.sent += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+                return
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.max_retries:
+                    job.future.set_exception(e)
+                    return
+                self.rate_limited += 1
+                metrics.incr('discord_rate_limited_total')
+                await asyncio.sleep(getattr(e, 'retry_after', None) or self.per)
+            except Exception as e:
+                job.future.set_exception(e)
+                return
+
+    def get_bucket(self, channel_id, route):
+        if (channel_id, route) not in self.buckets:
+            self.buckets[(channel_id, route)] = RouteBucket(self.rate, self.per)
+        return self.buckets[(channel_id, route)]
+
+    @staticmethod
+    def log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            print('Error sending message: ' + str(future.exception()))
+
+    def get_depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def get_stats(self):
+        return {
+            'depth': self.get_depth(),
+            'channels': len(self.queues),
+            'sent': self.sent,
+            'merged': self.merged,
+            'rate_limited': self.rate_limited,
+            'avg_wait': self.total_wait / self.started if self.started > 0 else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+    def cancel(self):
+        for worker in list(self.workers.values()):
+            worker.cancel()
+        for queue in self.queues.values():
+            for _, _, job in queue:
+                job.future.cancel()
+            queue.clear()
+        self.pending.clear()
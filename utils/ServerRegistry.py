@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+
+from utils.Metrics import metrics
+from utils.PollScheduler import PollScheduler
+from utils.QueryClient import QueryClient
+
+def normalize_address(server):
+    # An explicit port stays part of the key, it skips the SRV lookup a bare host name goes through
+    return server.strip().lower().rstrip('.')
+
+class ServerRegistry:
+    def __init__(self, poller, ttl=None, scheduler=None, query_client=None):
+        if ttl is None:
+            ttl = float(os.environ.get('CREPESBOT_STATUS_TTL', 30))
+        if query_client is None and os.environ.get('CREPESBOT_QUERY', '0') == '1':
+            query_client = QueryClient()
+        self.poller = poller
+        self.query_client = query_client
+        self.scheduler = scheduler if scheduler is not None else PollScheduler()
+        self.ttl = ttl
+        self.servers = {}
+        self.subscribers = {}
+        self.updated_at = {}
+        self.in_flight = {}
+
+    def subscribe(self, server, subscriber, factory):
+        address = normalize_address(server)
+        if address not in self.servers:
+            self.servers[address] = factory(server)
+            self.subscribers[address] = set()
+            self.scheduler.add(address)
+        self.subscribers[address].add(subscriber)
+        return self.servers[address]
+
+    def unsubscribe(self, server, subscriber):
+        address = normalize_address(server)
+        if address in self.subscribers:
+            self.subscribers[address].discard(subscriber)
+            if len(self.subscribers[address]) == 0:
+                del self.subscribers[address]
+                metrics.forget(self.servers.pop(address).server)
+                self.updated_at.pop(address, None)
+                self.scheduler.remove(address)
+
+    def get(self, server):
+        return self.servers.get(normalize_address(server))
+
+    def is_fresh(self, address, now=None, full=False):
+        if now is None:
+            now = time.monotonic()
+        if full:
+            # Tier probes only confirm reachability, players and version come from the last full ping
+            server = self.servers.get(address)
+            return server is not None and server.full_at > 0 and now - server.full_at < self.ttl
+        updated_at = self.updated_at.get(address)
+        return updated_at is not None and now - updated_at < self.ttl
+
+    async def wait_in_flight(self, addresses):
+        # A server is never probed twice at once, callers share the probe that is already running
+        while True:
+            busy = [self.in_flight[a] for a in addresses if a in self.in_flight]
+            if len(busy) == 0:
+                return
+            await asyncio.wait(busy)
+
+    async def probe(self, addresses, full=False):
+        loop = asyncio.get_event_loop()
+        for address in addresses:
+            self.in_flight[address] = loop.create_future()
+        try:
+            await self.poller.poll([self.servers[a] for a in addresses if a in self.servers], full=full)
+            await self.query([self.servers[a] for a in addresses if a in self.servers])
+        finally:
+            now = time.monotonic()
+            for address in addresses:
+                if address in self.servers:
+                    self.updated_at[address] = now
+                self.in_flight.pop(address).set_result(None)
+
+    async def refresh(self, servers=None, force=False):
+        if servers is None:
+            addresses = list(self.servers)
+        else:
+            addresses = {normalize_address(s.server) for s in servers}
+        await self.wait_in_flight(addresses)
+        now = time.monotonic()
+        stale = [a for a in addresses if a in self.servers and (force or not self.is_fresh(a, now, full=True))]
+        metrics.incr('status_cache_hits_total', len(addresses) - len(stale))
+        metrics.incr('status_cache_misses_total', len(stale))
+        if len(stale) == 0:
+            return
+        # Each unique server is probed once, whatever the number of subscribing channels
+        await self.probe(stale, full=True)
+
+    async def refresh_due(self):
+        due = [a for a in self.scheduler.pop_due() if a in self.servers]
+        if len(due) == 0:
+            return
+        start = time.perf_counter()
+        try:
+            await self.probe([a for a in due if a not in self.in_flight])
+            await self.wait_in_flight(due)
+        finally:
+            metrics.observe('poll_cycle_seconds', time.perf_counter() - start)
+            metrics.incr('poll_cycles_total')
+            now = time.monotonic()
+            for address in due:
+                server = self.servers.get(address)
+                if server is not None:
+                    # Unsettled servers are re-probed quickly so real changes are confirmed without waiting a full interval
+                    self.scheduler.reschedule(address, server.online, server.wants_fast_poll(), now)
+
+    async def query(self, servers):
+        if self.query_client is None:
+            return
+        online = [s for s in servers if s.online]
+        if len(online) == 0:
+            return
+        try:
+            # One batch per cycle, the query round trips are shared by every server in it
+            targets = await asyncio.gather(*[self.poller.resolver.lookup(s.server) for s in online], return_exceptions=True)
+            results = await self.query_client.query_many({s: t for s, t in zip(online, targets) if not isinstance(t, Exception)})
+            for server in online:
+                server.apply_query(results.get(server))
+        except Exception as e:
+            print('Error querying servers: ' + str(e))
+
+    async def wait_until_due(self):
+        await self.scheduler.wait()
+
+    def close(self):
+        if self.query_client is not None:
+            self.query_client.close()
@@ -0,0 +1,104 @@
+import os
+import time
+from array import array
+
+HOUR = 3600
+
+class StatusHistory:
+    def __init__(self, samples=None, hours=None, max_gap=1800):
+        if samples is None:
+            samples = int(os.environ.get('CREPESBOT_HISTORY_SAMPLES', 256))
+        if hours is None:
+            hours = int(os.environ.get('CREPESBOT_HISTORY_HOURS', 168))
+        self.samples = max(1, samples)
+        self.hours = max(1, hours)
+        self.max_gap = max_gap
+
+        # Raw ring buffer of the most recent probes
+        self.times = array('d', [0.0]) * self.samples
+        self.online = array('b', [0]) * self.samples
+        self.players = array('i', [0]) * self.samples
+        self.head = 0
+        self.count = 0
+
+        # Hourly buckets, time weighted so adaptive polling doesn't skew uptime
+        self.hour_ids = array('q', [-1]) * self.hours
+        self.hour_total = array('f', [0.0]) * self.hours
+        self.hour_online = array('f', [0.0]) * self.hours
+        self.hour_peak = array('i', [0]) * self.hours
+        self.hour_peak_time = array('d', [0.0]) * self.hours
+
+    def get_bucket(self, timestamp):
+        hour_id = int(timestamp // HOUR)
+        index = hour_id % self.hours
+        if self.hour_ids[index] != hour_id:
+            self.hour_ids[index] = hour_id
+            self.hour_total[index] = 0.0
+            self.hour_online[index] = 0.0
+            self.hour_peak[index] = 0
+            self.hour_peak_time[index] = timestamp
+        return index
+
+    def record(self, online, players, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if self.count > 0:
+            last = (self.head - 1) % self.samples
+            elapsed = timestamp - self.times[last]
+            # Gaps longer than max_gap are bot downtime, not server downtime
+            if 0 < elapsed <= self.max_gap:
+                index = self.get_bucket(self.times[last])
+                self.hour_total[index] += elapsed
+                if self.online[last]:
+                    self.hour_online[index] += elapsed
+
+        index = self.get_bucket(timestamp)
+        if players > self.hour_peak[index]:
+            self.hour_peak[index] = players
+            self.hour_peak_time[index] = timestamp
+
+        self.times[self.head] = timestamp
+        self.online[self.head] = 1 if online else 0
+        self.players[self.head] = players
+        self.head = (self.head + 1) % self.samples
+        self.count = min(self.count + 1, self.samples)
+
+    def recent(self, limit=None):
+        if limit is None or limit > self.count:
+            limit = self.count
+        samples = []
+        for i in range(limit):
+            index = (self.head - limit + i) % self.samples
+            samples.append((self.times[index], bool(self.online[index]), self.players[index]))
+        return samples
+
+    def hourly(self, hours, now=None):
+        if now is None:
+            now = time.time()
+        current = int(now // HOUR)
+        buckets = []
+        for hour_id in range(current - min(hours, self.hours) + 1, current + 1):
+            index = hour_id % self.hours
+            if self.hour_ids[index] == hour_id:
+                buckets.append((hour_id * HOUR, self.hour_total[index], self.hour_online[index], self.hour_peak[index]))
+        return buckets
+
+    def uptime(self, seconds, now=None):
+        total = 0.0
+        online = 0.0
+        for _, bucket_total, bucket_online, _ in self.hourly(int(seconds // HOUR) + 1, now):
+            total += bucket_total
+            online += bucket_online
+        if total == 0:
+            return None
+        return online / total
+
+    def peak(self, seconds, now=None):
+        if now is None:
+            now = time.time()
+        best = None
+        for hour_id in range(int(now // HOUR) - min(int(seconds // HOUR) + 1, self.hours) + 1, int(now // HOUR) + 1):
+            index = hour_id % self.hours
+            if self.hour_ids[index] == hour_id and (best is None or self.hour_peak[index] > best[0]):
+                best = (self.hour_peak[index], self.hour_peak_time[index])
+        return best
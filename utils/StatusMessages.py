@@ -0,0 +1,76 @@
+import discord
+
+# Multiple embeds per message need discord.py 2.x; older clients get one embed per message
+MAX_EMBEDS_PER_MESSAGE = 10 if discord.version_info.major >= 2 else 1
+
+async def send_embeds(channel, embeds):
+    if MAX_EMBEDS_PER_MESSAGE > 1:
+        return await channel.send(embeds=embeds)
+    return await channel.send(embed=embeds[0])
+
+async def edit_embeds(message, embeds):
+    if MAX_EMBEDS_PER_MESSAGE > 1:
+        await message.edit(embeds=embeds)
+    else:
+        await message.edit(embed=embeds[0])
+
+class StatusMessageTracker:
+    def __init__(self):
+        self.messages = []
+
+    def is_empty(self):
+        return len(self.messages) == 0
+
+    @staticmethod
+    def layout(servers):
+        return [tuple(servers[i:i + MAX_EMBEDS_PER_MESSAGE]) for i in range(0, len(servers), MAX_EMBEDS_PER_MESSAGE)]
+
+    @staticmethod
+    def render(chunk):
+        return [s.get_embed() for s in chunk]
+
+    async def publish(self, channel, servers, changed):
+        published = []
+        changed = set(changed)
+        chunks = StatusMessageTracker.layout(servers)
+        try:
+            for i, chunk in enumerate(chunks):
+                if i < len(self.messages):
+                    message_id, tracked_chunk = self.messages[i]
+                    if tracked_chunk == chunk and changed.isdisjoint(chunk):
+                        published.append(self.messages[i])
+                        continue
+                    embeds = StatusMessageTracker.render(chunk)
+                    try:
+                        await edit_embeds(channel.get_partial_message(message_id), embeds)
+                        published.append((message_id, chunk))
+                        continue
+                    except discord.NotFound:
+                        # Someone deleted the post, fall through to a fresh one
+                        pass
+                else:
+                    embeds = StatusMessageTracker.render(chunk)
+                message = await send_embeds(channel, embeds)
+                published.append((message.id, chunk))
+        except Exception:
+            # Keep track of what did go out, a retry edits those messages instead of posting them twice
+            self.messages = published + self.messages[len(published):]
+            raise
+
+        stale = self.messages[len(chunks):]
+        self.messages = published
+        for message_id, _ in stale:
+            await StatusMessageTracker.delete(channel, message_id)
+
+    async def clear(self, channel):
+        messages = self.messages
+        self.messages = []
+        for message_id, _ in messages:
+            await StatusMessageTracker.delete(channel, message_id)
+
+    @staticmethod
+    async def delete(channel, message_id):
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except discord.NotFound:
+            pass
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import time
+
+from utils.Metrics import metrics
+from utils.ResolverCache import ResolverCache
+
+class StatusPoller:
+    def __init__(self, max_concurrency=None, timeout=None, resolver=None):
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get('CREPESBOT_POLL_CONCURRENCY', 32))
+        if timeout is None:
+            timeout = float(os.environ.get('CREPESBOT_PROBE_TIMEOUT', 5))
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.resolver = resolver if resolver is not None else ResolverCache()
+        self.semaphore = None
+        self.tasks = set()
+
+    async def probe(self, server_status, full):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            start = time.perf_counter()
+            tier = 'full'
+            try:
+                tier = await server_status.update_status(self.timeout, self.resolver, full)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print('Error probing ' + server_status.server + ': ' + str(e))
+                metrics.incr('probe_errors_total')
+                server_status.set_offline()
+            record_probe(server_status, time.perf_counter() - start, tier)
+
+    async def poll(self, servers, full=False):
+        self.resolver.prune()
+        tasks = [asyncio.ensure_future(self.probe(s, full)) for s in servers]
+        self.tasks.update(tasks)
+        try:
+            # One cycle takes as long as the slowest probe, not the sum of them
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                self.tasks.discard(task)
+
+    def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+def record_probe(server_status, elapsed, tier='full'):
+    metrics.observe('probe_seconds', elapsed, server_status.server)
+    metrics.incr('probes_total')
+    metrics.incr('probe_tier_total', label=tier)
+    metrics.observe('probe_tier_seconds', elapsed, tier)
+    if not server_status.online:
+        metrics.incr('probes_offline_total')
+
+def create_poller():
+    workers = int(os.environ.get('CREPESBOT_PROBE_WORKERS', 0))
+    if workers > 0:
+        # Imported here so the default in-process mode never loads multiprocessing
+        from utils.ProbeWorkers import ProcessPoller
+        poller = StatusPoller()
+        return ProcessPoller(workers, poller.max_concurrency, poller.timeout)
+    return StatusPoller()
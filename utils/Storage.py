@@ -0,0 +1,117 @@
+import os
+import sqlite3
+
+class StorageBackend:
+    def load(self):
+        raise NotImplementedError
+
+    def add_server(self, channel_id, server):
+        raise NotImplementedError
+
+    def remove_server(self, channel_id, server):
+        raise NotImplementedError
+
+    def add_servers(self, channel_id, servers):
+        for server in servers:
+            self.add_server(channel_id, server)
+
+    def remove_servers(self, channel_id, servers):
+        for server in servers:
+            self.remove_server(channel_id, server)
+
+    def set_aternos_server(self, channel_id, server):
+        raise NotImplementedError
+
+    def replace_all(self, state):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SqliteStorage(StorageBackend):
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS servers (channel_id INTEGER NOT NULL, server TEXT NOT NULL, PRIMARY KEY (channel_id, server))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS aternos (channel_id INTEGER PRIMARY KEY, server TEXT NOT NULL)')
+        self.db.commit()
+
+    def load(self):
+        state = {}
+        # rowid keeps each channel's watchlist in the order servers were added
+        for channel_id, server in self.db.execute('SELECT channel_id, server FROM servers ORDER BY rowid'):
+            state.setdefault(channel_id, {'watchlist': [], 'aternos': ''})['watchlist'].append(server)
+        for channel_id, server in self.db.execute('SELECT channel_id, server FROM aternos'):
+            state.setdefault(channel_id, {'watchlist': [], 'aternos': ''})['aternos'] = server
+        return state
+
+    def add_server(self, channel_id, server):
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO servers (channel_id, server) VALUES (?, ?)', (channel_id, server))
+
+    def remove_server(self, channel_id, server):
+        with self.db:
+            self.db.execute('DELETE FROM servers WHERE channel_id = ? AND server = ?', (channel_id, server))
+
+    def add_servers(self, channel_id, servers):
+        # A whole batch goes in as a single transaction
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO servers (channel_id, server) VALUES (?, ?)', [(channel_id, s) for s in servers])
+
+    def remove_servers(self, channel_id, servers):
+        with self.db:
+            self.db.executemany('DELETE FROM servers WHERE channel_id = ? AND server = ?', [(channel_id, s) for s in servers])
+
+    def set_aternos_server(self, channel_id, server):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO aternos (channel_id, server) VALUES (?, ?)', (channel_id, server))
+
+    def replace_all(self, state):
+        with self.db:
+            self.db.execute('DELETE FROM servers')
+            self.db.execute('DELETE FROM aternos')
+            for channel_id, payload in state.items():
+                self.db.executemany('INSERT OR IGNORE INTO servers (channel_id, server) VALUES (?, ?)', [(int(channel_id), s) for s in payload.get('watchlist', [])])
+                if len(payload.get('aternos', '')) > 0:
+                    self.db.execute('INSERT OR REPLACE INTO aternos (channel_id, server) VALUES (?, ?)', (int(channel_id), payload['aternos']))
+
+    def close(self):
+        self.db.close()
+
+class MemoryStorage(StorageBackend):
+    def __init__(self):
+        self.watchlists = {}
+        self.aternos = {}
+
+    def load(self):
+        state = {}
+        for channel_id, watchlist in self.watchlists.items():
+            state.setdefault(channel_id, {'watchlist': [], 'aternos': ''})['watchlist'] = list(watchlist)
+        for channel_id, server in self.aternos.items():
+            state.setdefault(channel_id, {'watchlist': [], 'aternos': ''})['aternos'] = server
+        return state
+
+    def add_server(self, channel_id, server):
+        # dict keys keep insertion order and give O(1) membership, like the servers table's primary key
+        self.watchlists.setdefault(channel_id, {})[server] = None
+
+    def remove_server(self, channel_id, server):
+        self.watchlists.get(channel_id, {}).pop(server, None)
+
+    def set_aternos_server(self, channel_id, server):
+        self.aternos[channel_id] = server
+
+    def replace_all(self, state):
+        self.watchlists = {}
+        self.aternos = {}
+        for channel_id, payload in state.items():
+            self.watchlists[int(channel_id)] = dict.fromkeys(payload.get('watchlist', []))
+            if len(payload.get('aternos', '')) > 0:
+                self.aternos[int(channel_id)] = payload['aternos']
+
+def create_storage():
+    if os.environ.get('CREPESBOT_STORAGE', 'sqlite') == 'memory':
+        return MemoryStorage()
+    return SqliteStorage(os.environ.get('CREPESBOT_DB_PATH', 'crepesbot.db'))
@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import os
+import time
+
+from utils.Metrics import metrics
+
+class WriteBehindSaver:
+    def __init__(self, dbx_manager, filename, delay=None, max_delay=None):
+        if delay is None:
+            delay = float(os.environ.get('CREPESBOT_SAVE_DELAY', 5))
+        if max_delay is None:
+            max_delay = float(os.environ.get('CREPESBOT_SAVE_MAX_DELAY', 30))
+        self.dbx_manager = dbx_manager
+        self.filename = filename
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+        self.snapshot = None
+        self.dirty = False
+        self.first_change = None
+        self.last_change = None
+        self.last_hash = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.task = None
+        self.lock = None
+        self.flushes = 0
+        self.skipped = 0
+
+    @staticmethod
+    def get_hash(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def mark_clean(self, content):
+        self.last_hash = WriteBehindSaver.get_hash(content)
+
+    def schedule(self, snapshot):
+        now = time.monotonic()
+        self.snapshot = snapshot
+        if not self.dirty:
+            self.first_change = now
+        self.dirty = True
+        self.last_change = now
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        # Wait for the burst to go quiet, but never hold a change longer than max_delay
+        while self.dirty:
+            due = max(min(self.last_change + self.delay, self.first_change + self.max_delay), self.retry_at)
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self.flush()
+
+    async def flush(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            content = self.snapshot()
+            content_hash = WriteBehindSaver.get_hash(content)
+            if content_hash == self.last_hash:
+                self.skipped += 1
+                metrics.incr('saves_skipped_total')
+                return
+            loop = asyncio.get_event_loop()
+            start = time.perf_counter()
+            uploaded = await loop.run_in_executor(None, self.dbx_manager.upload, self.filename, content)
+            metrics.observe('save_seconds', time.perf_counter() - start)
+            if uploaded:
+                self.last_hash = content_hash
+                self.failures = 0
+                self.retry_at = 0.0
+            else:
+                # Stays dirty and is retried with backoff, a fresh dyno would otherwise restore stale data
+                metrics.incr('save_errors_total')
+                self.failures += 1
+                self.retry_at = time.monotonic() + min(self.delay * 2 ** self.failures, 300)
+                self.dirty = True
+            self.flushes += 1
+
+    async def close(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        await self.flush()
+        if self.dirty:
+            print('Could not upload ' + self.filename + ' before shutdown')